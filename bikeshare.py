@@ -6,12 +6,18 @@
 # #############################################################################
 
 
+import os
 import dash
+import diskcache
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
+import dash_table
 import logging
 import bikeshare_helper as bk
+import bikeshare_metrics as metrics
+from bikeshare_session import SESSIONS, new_session_id
+from bikeshare_warmup import PRELOAD_CITIES, WarmUp, register_readiness_route
 from dash.dependencies import Input, Output, State
 
 
@@ -23,7 +29,30 @@ log.setLevel(logging.ERROR)
 
 # Create the App
 # #############################################################################
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# The stats are computed by background callbacks: each one runs as a job in a
+# separate process (forked from the app process, so it shares the loaded city
+# data) and reports its progress and result through a disk cache, leaving the
+# request workers free. Needs diskcache, multiprocess and psutil (dash[diskcache])
+BACKGROUND_MANAGER = dash.DiskcacheManager(diskcache.Cache(os.path.join(bk.CACHE_DIR, 'jobs')))
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+                background_callback_manager=BACKGROUND_MANAGER)
+
+# Serve the hot path timings in the Prometheus text format on '/metrics'
+metrics.register_metrics_route(app.server)
+metrics.register_gauge('bikeshare_frame_cache', "Counters of the in-memory city data cache",
+                       bk.FRAME_CACHE.stats)
+metrics.register_gauge('bikeshare_cube_cache', "Counters of the in-memory city cube cache",
+                       bk.CUBE_CACHE.stats)
+metrics.register_gauge('bikeshare_stream_cache', "Counters of the cache of filtered frames read in streaming mode",
+                       bk.STREAM_CACHE.stats)
+metrics.register_gauge('bikeshare_result_cache', "Counters of the cache of computed results",
+                       bk.RESULT_CACHE.stats)
+
+# Preload the cities in the background; '/ready' answers 200 once they are loaded.
+# The warm-up starts with the server (or on its first request), not on import
+WARMUP = WarmUp(PRELOAD_CITIES)
+register_readiness_route(app.server, WARMUP)
 
 
 # Callback functions
@@ -32,6 +61,7 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
     Output('month-div', 'style'),
     Output('weekday-div', 'style'),
     [Input('filter-dropdown', 'value')])
+@metrics.timed('show_weekday_month_dropdown', 'callback', profile=True)
 def show_weekday_month_dropdown(filter_value):
     """
     Displays month and/or weekday dropdown options based on the main filter selection
@@ -49,149 +79,245 @@ def show_weekday_month_dropdown(filter_value):
 
 
 
-# Callback loads the global dataframe depending upon user filters
-@app.callback(
-    [
-        Output('error-msg-placeholder', 'children'),
+# Outputs of every tab, in the order of the stats pipeline results
+TAB_OUTPUTS = {
+    'time': [
         Output('time-table-header', 'children'),
         Output('time-table', 'children'),
         Output('tab-time-exec', 'children'),
     ],
-    [Input('submit-button', 'n_clicks')],
+    'station': [
+        Output('station-table-header', 'children'),
+        Output('station-table', 'children'),
+        Output('tab-station-exec', 'children'),
+    ],
+    'trip': [
+        Output('trip-table-header', 'children'),
+        Output('trip-table', 'children'),
+        Output('trip-duration-histogram', 'figure'),
+        Output('tab-trip-exec', 'children'),
+    ],
+    'user': [
+        Output('user-type-table', 'children'),
+        Output('user-type-pie-chart', 'figure'),
+        Output('user-gender-table', 'children'),
+        Output('user-age-table', 'children'),
+        Output('tab-user-exec', 'children'),
+    ],
+    'riders': [
+        Output('riders-table-header', 'children'),
+        Output('riders-table', 'columns'),
+        Output('riders-table', 'data'),
+        Output('riders-table', 'page_current'),
+        Output('tab-riders-exec', 'children'),
+    ],
+    'raw': [
+        Output('raw-data-caption', 'children'),
+        Output('table', 'columns'),
+        Output('table', 'data'),
+        Output('table', 'page_current'),
+        Output('table', 'page_count'),
+        Output('no-more-text', 'children'),
+    ],
+}
+
+# The tab outputs again, for the submit callback emptying the tabs that
+# load_filter_data() fills in
+TAB_OUTPUTS_EMPTIED = [Output(output.component_id, output.component_property, allow_duplicate=True)
+                       for outputs in TAB_OUTPUTS.values() for output in outputs]
+
+
+# Callback stores the user filters in the session when they are submitted and
+# empties the tabs, so no results of the previous selection are shown before
+# they are filled in. It is quick, so it runs within the request
+@app.callback(
+    [Output('selection', 'data'), Output('filled-tabs', 'data', allow_duplicate=True)]
+    + TAB_OUTPUTS_EMPTIED,
+    Input('submit-button', 'n_clicks'),
     [
         State('city-dropdown', 'value'),
         State('filter-dropdown', 'value'),
         State('month-dropdown', 'value'),
         State('weekday-dropdown', 'value'),
+        State('date-range', 'start_date'),
+        State('date-range', 'end_date'),
+        State('hour-range', 'value'),
+        State('session-id', 'data'),
     ],
     prevent_initial_call=True
 )
-def load_filter_data(n_clicks, city, data_filter, month, weekday):
+@metrics.timed('submit_filters', 'callback', profile=True)
+def submit_filters(n_clicks, city, data_filter, month, weekday, start_date, end_date, hour_range, session_id):
+    """
+    Stores the user filter selections in the session state and empties the tabs
+    """
+    # Reset month and/or weekday to 'none' unless data_filter uses them
+    # (the hidden dropdowns keep their values)
+    if data_filter not in ('month', 'both') or not month:
+        month = 'none'
+    if data_filter not in ('weekday', 'both') or not weekday:
+        weekday = 'none'
+    # Store the filters and reset the raw data page to the first one
+    SESSIONS.save(session_id, {'city': city,
+                               'month': month,
+                               'weekday': weekday,
+                               'date_range': None if start_date is None and end_date is None else [start_date, end_date],
+                               'hours': None if hour_range == [0, 23] else hour_range,
+                               'page': 0})
+
+    # The new selection (the submit count) starts the computation of the active tab
+    output_list = [n_clicks, []]
+    for outputs in TAB_OUTPUTS.values():
+        output_list.extend(empty_outputs(outputs))
+    return output_list
+
+
+
+# Callback computes the tab the user is looking at for the submitted selection,
+# as a background job showing its progress; the other tabs are prefetched once
+# it is done and computed when they are first opened. Submitting again or
+# opening another tab while a job runs cancels it (Dash terminates the job of
+# the superseded request), and so does the 'Cancel' button
+@app.callback(
+    [Output('error-msg-placeholder', 'children'), Output('pipeline-exec', 'children'), Output('filled-tabs', 'data')]
+    + [output for outputs in TAB_OUTPUTS.values() for output in outputs],
+    [Input('selection', 'data'),
+     Input('tabs', 'active_tab')],
+    [State('filled-tabs', 'data'),
+     State('session-id', 'data')],
+    background=True,
+    progress=[Output('progress-bar', 'value'), Output('progress-text', 'children')],
+    progress_default=[0, ""],
+    running=[(Output('progress-div', 'style'), {'display': 'block'}, {'display': 'none'}),
+             (Output('cancel-button', 'disabled'), False, True)],
+    cancel=[Input('cancel-button', 'n_clicks')],
+    interval=250,
+    prevent_initial_call=True
+)
+@metrics.spooled
+@metrics.timed('load_filter_data', 'callback', profile=True)
+def load_filter_data(set_progress, selection, active_tab, filled_tabs, session_id):
     """
-    Loads the global dataframe and initializes global variables,
-    depending upon user filter selections
+    Computes the contents of the active tab for the filter selections stored
+    in the session, unless the tab was filled in since the last submit
     """
 
-    if n_clicks is None:
+    # Tab ids are '<tab>-tab'
+    tab = active_tab.split('-')[0]
+    state = SESSIONS.get(session_id)
+    if state['city'] is None or tab in filled_tabs:
         raise dash.exceptions.PreventUpdate
-    else:
-        # Reset month and weekday to 'none' if data_filter is 'none'
-        if data_filter == 'none':
-            month = 'none'
-            weekday = 'none'
-        try:
-            # Load global data frame and city name
-            bk.DF = bk.load_data(city, month, weekday)
-            bk.CITY = city
-
-            # Reset ROW_COUNTER to zero for raw data
-            bk.ROW_COUNTER = 0
-
-            # Get Time tab contents
-            output_list = update_time_tab(bk.DF)
-
-            # Insert empty error msg at the beginning of the list
-            output_list.insert(0, dash.no_update)
-        except Exception as e:
-            print("Error occurred in load_filter_data(): {}".format(e))
-            output_list = ["Data File is Empty!!! Please check your data!", dash.no_update, dash.no_update, dash.no_update]
-        finally:
-            return output_list
-
-
-
-# Update Time Stats Tab
-def update_time_tab(df):
-    """
-    Updates the output tab displaying Time Stats
-    Args:
-    (pd.DataFrame) df - the global dataframe which has been populated
 
-    Returns:
-    (list) output_list - this list contains all object for Dash Ouputs
-    """
+    def show_progress(done, total, stage):
+        set_progress([round(100 * done / total), stage])
 
     try:
-        output_list = bk.time_stats(df)
-        return output_list
+        # Compute the active tab from the (shared, cached) city data
+        results, timings = bk.stats_pipeline(state['city'], state['month'], state['weekday'], [tab],
+                                             state['date_range'], state['hours'], show_progress)
+
+        # Insert empty error msg, the pipeline timings and the filled in tabs
+        # at the beginning of the list
+        output_list = [dash.no_update, format_timings(timings), filled_tabs + [tab]]
+        for name, outputs in TAB_OUTPUTS.items():
+            if name == tab:
+                output_list.extend(results[name])
+            else:
+                output_list.extend([dash.no_update] * len(outputs))
     except Exception as e:
-        print("Some error occurred in update_time_tab(): {}".format(e))
+        print("Error occurred in load_filter_data(): {}".format(e))
+        output_list = ["Data File is Empty!!! Please check your data!"]
+        output_list.extend([dash.no_update] * (2 + len(TAB_OUTPUTS_EMPTIED)))
+    return output_list
 
 
 
-# Callback updates the Station Stats tab
-# Chained callback from Time Tab
+# Callback prefetches the tabs not shown yet once the active tab is shown.
+# It runs in the app process, whose prefetch threads outlive the request,
+# unlike the background job that computed the active tab; the prefetch also
+# loads the city into the app process, so later jobs inherit the loaded data
 @app.callback(
-    [
-        Output('station-table-header', 'children'),
-        Output('station-table', 'children'),
-        Output('tab-station-exec', 'children'),
-    ],
-    [Input('tab-time-exec', 'children')],
+    Input('pipeline-exec', 'children'),
+    [State('filled-tabs', 'data'),
+     State('session-id', 'data')],
     prevent_initial_call=True
 )
-def update_station_tab(value):
-    """ Updates the output tab displaying Station Stats  """
-    if value is None:
+@metrics.timed('prefetch_other_tabs', 'callback', profile=True)
+def prefetch_other_tabs(timings, filled_tabs, session_id):
+    """ Starts computing the tabs of the session selection that were not shown yet """
+    state = SESSIONS.get(session_id)
+    if state['city'] is None:
         raise dash.exceptions.PreventUpdate
-    else:
-        try:
-            output_list = bk.station_stats(bk.DF)
-            return output_list
-        except Exception as e:
-            print("Some error occurred in update_station_tab(): {}".format(e))
+    bk.prefetch_tabs(state['city'], state['month'], state['weekday'],
+                     [tab for tab in TAB_OUTPUTS if tab not in filled_tabs],
+                     state['date_range'], state['hours'])
 
 
 
-# Callback updates the Trip Stats tab
-# Chained callback from Station Tab
+# Callback for the 'Show next 5 rows' button and the data table paging
+# controls; paging is quick, so it runs within the request
 @app.callback(
-    [
-        Output('trip-table-header', 'children'),
-        Output('trip-table', 'children'),
-        Output('tab-trip-exec', 'children'),
-    ],
-    [Input('tab-station-exec', 'children')],
+    [Output(output.component_id, output.component_property, allow_duplicate=True)
+     for output in TAB_OUTPUTS['raw']],
+    [Input('more-button', 'n_clicks'),
+     Input('table', 'page_current')],
+    State('session-id', 'data'),
     prevent_initial_call=True
 )
-def update_trip_tab(value):
-    """ Updates the output tab displaying Trip Stats """
-    if value is None:
+@metrics.timed('page_raw_data', 'callback', profile=True)
+def page_raw_data(more_clicks, page_current, session_id):
+    """
+    Shows another page of the raw data tab
+    """
+    ctx_button = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    # The page is also set when the tab is filled in or emptied, which is
+    # already the page of the session
+    if ctx_button == 'table' and page_current == SESSIONS.get(session_id)['page']:
         raise dash.exceptions.PreventUpdate
-    else:
-        try:
-            output_list = bk.trip_duration_stats(bk.DF)
-            return output_list
-        except Exception as e:
-            print("Some error occurred in update_trip_tab(): {}".format(e))
+    return display_raw_data_tab(session_id, ctx_button, page_current)
 
 
-# Callback updates the User Stats tab
-# Chained callback from Trip Tab
-@app.callback(
-    [
-        Output('user-type-table', 'children'),
-        Output('user-type-pie-chart', 'figure'),
-        Output('user-gender-table', 'children'),
-        Output('user-age-table', 'children'),
-        Output('tab-user-exec', 'children'),
-    ],
-    [Input('tab-trip-exec', 'children')],
-    prevent_initial_call=True
-)
-def update_user_tab(value):
-    """ Updates the output tab displaying User Stats """
-    if value is None:
-        raise dash.exceptions.PreventUpdate
-    else:
-        try:
-            output_list = bk.user_stats(bk.DF)
-            return output_list
-        except Exception as e:
-            print("Some error occurred in update_user_tab(): {}".format(e))
+
+# Empty tab contents
+def empty_outputs(outputs):
+    """
+    Returns the values showing nothing for a list of outputs
+    Args:
+    (list) outputs - outputs of a tab, see TAB_OUTPUTS
+    """
+    empty_values = {'figure': {}, 'columns': [], 'data': [], 'page_current': 0, 'page_count': 1}
+    return [empty_values.get(output.component_property) for output in outputs]
+
+
+
+# Format the stats pipeline timings
+def format_timings(timings):
+    """
+    Returns the per-stage timings of the stats pipeline as display text
+    Args:
+    (dict) timings - seconds taken by each stage, see bk.stats_pipeline()
+    """
+    stages = ", ".join("{} {}s".format(stage, round(seconds, 4))
+                       for stage, seconds in timings.items() if stage != 'total')
+    return "Computed in {} seconds ({}).".format(round(timings['total'], 4), stages)
 
 
 
+# Load the data selected by a session
+def load_session_data(session_id):
+    """
+    Returns the city data filtered by the selections stored in the session state
+    Args:
+    (str) session_id - id of the user session, stored in the browser
+
+    Returns:
+    (pd.DataFrame) df - the filtered dataframe, taken from the shared city data cache
+    """
+    state = SESSIONS.get(session_id)
+    if state['city'] is None:
+        raise dash.exceptions.PreventUpdate
+    return bk.load_data(state['city'], state['month'], state['weekday'], state['date_range'], state['hours'])
+
 
 
 # Callback to show the raw data table if user clicks the 'yes' button
@@ -202,6 +328,7 @@ def update_user_tab(value):
     Input('submit-button', 'n_clicks'),
     prevent_initial_callback=True
 )
+@metrics.timed('show_raw_data_block', 'callback', profile=True)
 def show_raw_data_block(yes, no, submit):
     """ Makes the raw data table visible/unvisible  """
     ctx = dash.callback_context
@@ -215,43 +342,26 @@ def show_raw_data_block(yes, no, submit):
             return {'display': 'block'}
 
 
-# Callback updates the Raw Data tab
-# Chained callback from User Tab
-@app.callback(
-    [
-        Output('raw-data-caption', 'children'),
-        Output('raw-data-table', 'children'),
-        Output('no-more-text', 'children'),
-    ],
-    [Input('tab-user-exec', 'children'),
-     Input('more-button', 'n_clicks')],
-    prevent_initial_call=True
-)
-def display_raw_data_tab(value, n_clicks):
-    """ Loads raw data 5 rows at a time into the dash datatable for display  """
-    ctx = dash.callback_context
-    ctx_button = ctx.triggered[0]['prop_id'].split('.')[0]
-    if value is None:
-        raise dash.exceptions.PreventUpdate
+# Update the Raw Data tab
+def display_raw_data_tab(session_id, ctx_button, page_current):
+    """
+    Loads one page of raw data into the dash datatable for display.
+    The 'Show next 5 rows' button moves to the next page, the table paging
+    controls move to the page they request.
+    """
+    state = SESSIONS.get(session_id)
+    df = load_session_data(session_id)
+    if ctx_button == 'more-button':
+        page = state['page'] + 1
     else:
-        if ctx_button == 'more-button':
-            # Update the row_counter
-            if bk.ROW_COUNTER + bk.ROW_ADVANCE > len(bk.DF):
-                num_remaining_rows = len(bk.DF) - bk.ROW_COUNTER
-                bk.ROW_COUNTER += num_remaining_rows # Only add the remaining rows
-            else:
-                bk.ROW_COUNTER += bk.ROW_ADVANCE
-        else: # triggered by 'submit-button'
-            # dataframe has less than 5 rows
-            if len(bk.DF) < bk.ROW_ADVANCE:
-                bk.ROW_COUNTER += len(bk.DF)
-            else:
-                bk.ROW_COUNTER += bk.ROW_ADVANCE
-        try:
-            output_list = bk.display_raw_data(bk.DF)
-            return output_list
-        except Exception as e:
-            print("Some Error occurred in display_raw_data_tab(): {}".format(e))
+        page = page_current or 0
+    try:
+        output_list = bk.display_raw_data(df, page)
+        SESSIONS.update(session_id, page=output_list[3])
+        return output_list
+    except Exception as e:
+        print("Some Error occurred in display_raw_data_tab(): {}".format(e))
+        return [dash.no_update] * len(TAB_OUTPUTS['raw'])
 
 
 
@@ -318,7 +428,7 @@ main_card = dbc.Card(
                 html.Div([
                     # month filter label
                     html.P(),
-                    html.P("Select the month:"),
+                    html.P("Select the month(s):"),
 
                     dcc.Dropdown(
                         id='month-dropdown',
@@ -330,7 +440,8 @@ main_card = dbc.Card(
                             {'label': 'May', 'value': 'may'},
                             {'label': 'June', 'value': 'june'}
                         ],
-                        value='january',
+                        value=['january'],
+                        multi=True,
                         clearable=False,
                         style={'color': '#000000'}
                     ),
@@ -345,7 +456,7 @@ main_card = dbc.Card(
                 html.Div([
                     # weekday filter label
                     html.P(),
-                    html.P("Select the weekday:"),
+                    html.P("Select the weekday(s):"),
                     dcc.Dropdown(
                         id='weekday-dropdown',
                         options=[
@@ -357,7 +468,8 @@ main_card = dbc.Card(
                             {'label': 'Saturday', 'value': 'saturday'},
                             {'label': 'Sunday', 'value': 'sunday'}
                         ],
-                        value='sunday',
+                        value=['sunday'],
+                        multi=True,
                         clearable=False,
                         style={'color': '#000000'}
                     ),
@@ -367,6 +479,30 @@ main_card = dbc.Card(
                 ),
                 html.Br(),
 
+                # date range filter (optional, applied with any of the filters above)
+                html.P("Limit to a range of dates (optional):"),
+                dcc.DatePickerRange(
+                    id='date-range',
+                    min_date_allowed='2017-01-01',
+                    max_date_allowed='2017-06-30',
+                    initial_visible_month='2017-01-01',
+                    clearable=True,
+                ),
+                html.Br(),
+                html.Br(),
+
+                # hour of day filter (the full day applies no filter)
+                html.P("Limit to hours of the day:"),
+                dcc.RangeSlider(
+                    id='hour-range',
+                    min=0,
+                    max=23,
+                    step=1,
+                    value=[0, 23],
+                    marks={hour: str(hour) for hour in range(0, 24, 3)},
+                ),
+                html.Br(),
+
                 # Submit Button
                 html.P(),
                 html.Div([
@@ -374,6 +510,21 @@ main_card = dbc.Card(
                                id='submit-button',
                                style={'color': 'success'}),
                 ]),
+
+                # Progress of the stats computation, shown while it runs
+                html.Div([
+                    html.P(),
+                    html.P(id='progress-text'),
+                    dbc.Progress(id='progress-bar', value=0, striped=True, animated=True),
+                    html.P(),
+                    dbc.Button("Cancel",
+                               id='cancel-button',
+                               disabled=True,
+                               style={'color': 'danger'}),
+                ],
+                    id='progress-div',
+                    style={'display': 'none'}
+                ),
             ]
         )
     ],
@@ -391,6 +542,7 @@ tab_time_content = dbc.Card(
             html.P(id='time-table-header'),
             html.Div(id='time-table'),
             html.P(id='tab-time-exec'),
+            html.P(id='pipeline-exec'),
         ]
     ),
     color='dark',
@@ -420,6 +572,10 @@ tab_trip_content = dbc.Card(
         [
             html.P(id='trip-table-header'),
             html.Div(id='trip-table'),
+            html.Div(html.Div(
+                dcc.Graph(id='trip-duration-histogram', ),
+            ),
+            style={'width': '100%', 'display': 'flex', 'align-items':'center', 'justify-content': 'center'}),
             html.P(id='tab-trip-exec'),
         ]
     ),
@@ -464,6 +620,40 @@ tab_user_content = dbc.Card(
     outline=False,
 )
 
+# Tab Station Riders
+# #############################################################################
+tab_riders_content = dbc.Card(
+    dbc.CardBody(
+        [
+            html.Div([
+                html.H6(id='riders-table-header'),
+                # Sorted and paged in the browser: click a column header to sort by it
+                dash_table.DataTable(
+                    id='riders-table',
+                    columns=[],
+                    data=[],
+                    sort_action='native',
+                    page_action='native',
+                    page_current=0,
+                    page_size=15,
+                    style_table={
+                        'overflowX': 'scroll',
+                    },
+                    style_cell={'color': 'black'}
+                ),
+            ]),
+            html.Br(),
+
+            html.Div(
+                html.P(id='tab-riders-exec')
+            )
+        ]
+    ),
+    color='dark',
+    inverse=True,
+    outline=False,
+)
+
 # Tab Raw Data
 # #############################################################################
 tab_raw_content = dbc.Card(
@@ -483,7 +673,23 @@ tab_raw_content = dbc.Card(
             html.Div(
                 [
                     html.H6(id='raw-data-caption'),
-                    html.Div(id='raw-data-table'),
+                    # Paged on the server: only the rows of the current page are sent
+                    html.Div(
+                        dash_table.DataTable(
+                            id='table',
+                            columns=[],
+                            data=[],
+                            page_action='custom',
+                            page_current=0,
+                            page_size=bk.ROW_ADVANCE,
+                            page_count=1,
+                            style_table={
+                                'overflowY': 'scroll',
+                            },
+                            style_cell={'color': 'black'}
+                        ),
+                        id='raw-data-table'
+                    ),
                     html.P(),
 
                     # Show more data button
@@ -514,6 +720,7 @@ tab_card = dbc.Card(
             dbc.Tab(tab_station_content, label="Station Stats", tab_id='station-tab', label_style={'color': '#00AEF9'}),
             dbc.Tab(tab_trip_content, label="Trip Stats", tab_id='trip-tab', label_style={'color': '#00AEF9'}),
             dbc.Tab(tab_user_content, label="User Stats", tab_id='user-tab', label_style={'color': '#00AEF9'}),
+            dbc.Tab(tab_riders_content, label="Station Riders", tab_id='riders-tab', label_style={'color': '#00AEF9'}),
             dbc.Tab(tab_raw_content, label="Raw Data", tab_id='raw-tab', label_style={'color': '#00AEF9'}),
         ],
         id='tabs',
@@ -526,29 +733,45 @@ tab_card = dbc.Card(
 
 # App Layout
 # #############################################################################
-app.layout = html.Div([
-    # Header
-    dbc.Row([
-        dbc.Col(header_card),
-    ],
-        justify='center'
-    ),
+def serve_layout():
+    """
+    Builds the app layout on every page load, so each browser tab gets its own session id
+    """
+    return html.Div([
+        # Session id, used to look up the user's filters and raw data page on the server
+        dcc.Store(id='session-id', data=new_session_id()),
 
-    # Spacing underneath header
-    dbc.Row([dbc.Col(html.P())], justify='center'),
+        # Submit count of the selection being shown, and the tabs filled in for it
+        dcc.Store(id='selection'),
+        dcc.Store(id='filled-tabs', data=[]),
+
+        # Header
+        dbc.Row([
+            dbc.Col(header_card),
+        ],
+            justify='center'
+        ),
+
+        # Spacing underneath header
+        dbc.Row([dbc.Col(html.P())], justify='center'),
+
+        # Filter and Tab Ouput Cards
+        dbc.Row([
+            dbc.Col(main_card, width=4),
+            dbc.Col(tab_card, width=8)
+        ],
+            justify='right',
+            style={'margin-left': '0.5rem',
+                   'margin-right': '0.5rem'}
+        ),
+    ])
+
+
+app.layout = serve_layout
 
-    # Filter and Tab Ouput Cards
-    dbc.Row([
-        dbc.Col(main_card, width=4),
-        dbc.Col(tab_card, width=8)
-    ],
-        justify='right',
-        style={'margin-left': '0.5rem',
-               'margin-right': '0.5rem'}
-    ),
-])
 
 # Main Function
 # #############################################################################
 if __name__ == '__main__':
+    WARMUP.start()      # Preload the cities
     app.run_server()    # Start the Dash App Server
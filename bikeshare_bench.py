@@ -0,0 +1,448 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_bench.py' contains the performance benchmarks
+#   Usage: python bikeshare_bench.py suite --sizes 1000000 10000000 50000000
+#          python bikeshare_bench.py timestamps --rows 1000000
+#          python bikeshare_bench.py render
+#          python bikeshare_bench.py shards --rows 10000000 --workers 1 2 4 8
+# #############################################################################
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import shutil
+import tracemalloc
+import numpy as np
+import pandas as pd
+import plotly
+import bikeshare_helper as bk
+import bikeshare_cube as cube
+
+
+# Global variables and data structures
+# First day of the synthetic trips; the real data covers January to June 2017
+SYNTHETIC_START = pd.Timestamp('2017-01-01')
+SYNTHETIC_DAYS = 181
+NUM_STATIONS = 600
+
+# Synthetic files are written in chunks of this many rows
+GENERATOR_CHUNK_ROWS = 1000000
+
+# Cities of the suite and whether their files have the demographics columns
+BENCH_CITIES = {'chicago': True, 'nyc': True, 'washington': False}
+
+# Default data file sizes of the suite
+BENCH_SIZES = [1000000, 10000000, 50000000]
+
+# Results slower than the baseline by more than this fraction are flagged,
+# unless they are slower by less than REGRESSION_MIN_SECONDS, which is
+# within the run to run noise of the cold loads
+REGRESSION_TOLERANCE = 0.2
+REGRESSION_MIN_SECONDS = 0.05
+
+
+# #############################################################################
+# Function definitions
+def synthetic_city_data(rows, seed=0, demographics=True):
+    """
+    Generates random trips using the schema of the city data files.
+    The same rows and seed always generate the same trips.
+
+    Args:
+        (int) rows - number of trips to generate
+        (int) seed - seed of the random number generator
+        (bool) demographics - whether to add the 'Gender' and 'Birth Year' columns
+                              (the washington file has neither)
+    Returns:
+        df - Pandas DataFrame in the layout of the csv files
+    """
+    rng = np.random.default_rng(seed)
+    stations = np.array(["Station {}".format(i) for i in range(NUM_STATIONS)], dtype=object)
+    seconds = rng.integers(0, SYNTHETIC_DAYS * 24 * 60 * 60, rows)
+    start_time = SYNTHETIC_START + pd.to_timedelta(np.sort(seconds), unit='s')
+    duration = np.round(rng.lognormal(6.5, 0.8, rows)).astype(np.int64) + 60
+    end_time = start_time + pd.to_timedelta(duration, unit='s')
+
+    df = pd.DataFrame({
+        'Start Time': start_time.strftime(bk.TIMESTAMP_FORMAT),
+        'End Time': end_time.strftime(bk.TIMESTAMP_FORMAT),
+        'Trip Duration': duration.astype(np.float64),
+        # A few popular stations get most of the trips, like in the real data
+        'Start Station': stations[rng.zipf(1.3, rows) % NUM_STATIONS],
+        'End Station': stations[rng.zipf(1.3, rows) % NUM_STATIONS],
+        'User Type': rng.choice(np.array(['Subscriber', 'Customer', 'Dependent'], dtype=object),
+                                rows, p=[0.80, 0.1999, 0.0001]),
+    })
+    if demographics:
+        df['Gender'] = rng.choice(np.array(['Male', 'Female', None], dtype=object),
+                                  rows, p=[0.6, 0.25, 0.15])
+        birth_year = np.round(rng.normal(1981, 11, rows)).clip(1899, 2002)
+        birth_year[rng.random(rows) < 0.15] = np.nan
+        df['Birth Year'] = birth_year
+    return df
+
+
+def write_city_csv(path, rows, seed=0, demographics=True):
+    """
+    Writes a synthetic city data file (with the unnamed index column of the real files),
+    generating GENERATOR_CHUNK_ROWS rows at a time so large files fit in memory.
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    for chunk_number, first_row in enumerate(range(0, rows, GENERATOR_CHUNK_ROWS)):
+        chunk_rows = min(GENERATOR_CHUNK_ROWS, rows - first_row)
+        df = synthetic_city_data(chunk_rows, seed * 1000003 + chunk_number, demographics)
+        df.index = pd.RangeIndex(first_row, first_row + chunk_rows)
+        df.to_csv(tmp_path, mode='w' if first_row == 0 else 'a', header=first_row == 0)
+    os.replace(tmp_path, path)
+    return path
+
+
+def city_files(data_dir, rows, seed=0):
+    """
+    Returns the synthetic data file of each benchmark city with the given number
+    of rows, generating the files that don't exist yet.
+
+    Returns:
+        (dict) city_data - {city: path}, in the format of bk.CITY_DATA
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    city_data = {}
+    for city, demographics in BENCH_CITIES.items():
+        path = os.path.join(data_dir, "{}_{}_{}.csv".format(city, rows, seed))
+        if not os.path.exists(path):
+            print("Generating {}...".format(path))
+            write_city_csv(path, rows, seed, demographics)
+        city_data[city] = path
+    return city_data
+
+
+def measure(func, repeat=1):
+    """
+    Runs a function and measures it.
+
+    Returns:
+        result - the return value of the function
+        (float) seconds - the median of the timed runs
+        (float) peak_mb - peak memory allocated during one extra traced run, in MB
+    """
+    seconds = median_time(func, repeat)
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20
+
+
+def reset_caches():
+    """ Empties the in-memory caches so the next load is cold """
+    bk.FRAME_CACHE.clear()
+    bk.CUBE_CACHE.clear()
+
+
+def bench_city(city, rows, repeat=3):
+    """
+    Benchmarks load_data and each stats function on the data of one city.
+    bk.CITY_DATA and bk.CACHE_DIR must point to the benchmark files.
+
+    Args:
+        (str) city - name of the city to benchmark
+        (int) rows - number of rows of its data file (used for the throughput)
+        (int) repeat - number of timed runs of each stage; the cold stages empty
+                       the caches before every run
+    Returns:
+        (dict) results - {stage: {'seconds', 'rows_per_s', 'peak_mb'}}
+    """
+    results = {}
+
+    def record(stage, func):
+        result, seconds, peak_mb = measure(func, repeat)
+        results[stage] = {'seconds': seconds,
+                          'rows_per_s': rows / seconds if seconds else float('inf'),
+                          'peak_mb': peak_mb}
+        return result
+
+    def cold_load():
+        reset_caches()
+        shutil.rmtree(bk.CACHE_DIR, ignore_errors=True)
+        return bk.load_data(city, 'none', 'none')
+
+    def disk_load():
+        reset_caches()
+        return bk.load_data(city, 'none', 'none')
+
+    # Loading: parsing the csv file, reading the columnar cache, and the in-memory cache
+    record('load_data (csv)', cold_load)
+    record('load_data (disk cache)', disk_load)
+    record('load_data (memory)', lambda: bk.load_data(city, 'none', 'none'))
+    df = record('load_data (memory, filtered)', lambda: bk.load_data(city, 'june', 'friday'))
+
+    def cold_cube():
+        bk.CUBE_CACHE.clear()
+        cube_file = os.path.join(bk.CACHE_DIR, "{}.cube.pkl".format(city))
+        if os.path.exists(cube_file):
+            os.remove(cube_file)
+        return bk.load_city_cube(city)
+
+    # The stats functions take the cube summary of the filter selection
+    record('build cube', cold_cube)
+    summary = record('load_summary', lambda: bk.load_summary(city, 'june', 'friday'))
+    record('time_stats', lambda: bk.time_stats(summary))
+    record('station_stats', lambda: bk.station_stats(summary))
+    record('trip_duration_stats', lambda: bk.trip_duration_stats(summary))
+    record('user_stats', lambda: bk.user_stats(summary, city))
+    record('display_raw_data', lambda: bk.display_raw_data(df, len(df) // bk.ROW_ADVANCE))
+    return results
+
+
+def run_suite(sizes, data_dir, repeat=3, seed=0):
+    """
+    Runs the benchmarks of every city for every data file size.
+
+    Returns:
+        (dict) results - {"<city>/<rows>/<stage>": {'seconds', 'rows_per_s', 'peak_mb'}}
+    """
+    results = {}
+    city_data, cache_dir = bk.CITY_DATA, bk.CACHE_DIR
+    try:
+        for rows in sizes:
+            bk.CITY_DATA = city_files(data_dir, rows, seed)
+            bk.CACHE_DIR = os.path.join(data_dir, "cache_{}".format(rows))
+            for city in BENCH_CITIES:
+                for stage, result in bench_city(city, rows, repeat).items():
+                    results["{}/{}/{}".format(city, rows, stage)] = result
+    finally:
+        bk.CITY_DATA, bk.CACHE_DIR = city_data, cache_dir
+        reset_caches()
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE, min_seconds=REGRESSION_MIN_SECONDS):
+    """
+    Returns the benchmarks that are slower than in the baseline by more than the
+    tolerance and by more than min_seconds.
+
+    Returns:
+        (list) regressions - (name, baseline seconds, seconds) tuples
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        if result['seconds'] > before * (1 + tolerance) and result['seconds'] - before > min_seconds:
+            regressions.append((name, before, result['seconds']))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """ Prints the suite results, with the change from the baseline if there is one """
+    print("{:<58} {:>10} {:>14} {:>10} {:>9}".format('benchmark', 'seconds', 'rows/s', 'peak MB', 'change'))
+    for name, result in results.items():
+        change = ""
+        if baseline and name in baseline and baseline[name]['seconds']:
+            change = "{:+.0%}".format(result['seconds'] / baseline[name]['seconds'] - 1)
+        print("{:<58} {:>10.4f} {:>14,.0f} {:>10.1f} {:>9}".format(
+            name, result['seconds'], result['rows_per_s'], result['peak_mb'], change))
+
+
+def best_time(func, repeat=3):
+    """ Returns the fastest of several runs of a function, in seconds """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def median_time(func, repeat=3):
+    """ Returns the median of several runs of a function, in seconds """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+
+def bench_timestamps(rows, repeat=3):
+    """
+    Compares the timestamp parsing of load_data before and after the known
+    format parser and the lazy 'End Time' conversion.
+
+    Args:
+        (int) rows - number of rows of the synthetic file
+        (int) repeat - number of runs per variant (the fastest one is reported)
+    Returns:
+        (dict) timings - seconds per variant
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = write_city_csv(os.path.join(tmp_dir, 'city.csv'), rows)
+        raw = pd.read_csv(path, usecols=['Start Time', 'End Time'])
+
+    timings = {
+        # Before: both columns parsed without a format
+        'inferred, start and end': best_time(lambda: (pd.to_datetime(raw['Start Time']),
+                                                      pd.to_datetime(raw['End Time'])), repeat),
+        'known format, start and end': best_time(lambda: (bk.parse_timestamps(raw['Start Time']),
+                                                          bk.parse_timestamps(raw['End Time'])), repeat),
+        # After: only the start times are parsed when the data is loaded
+        'known format, start only': best_time(lambda: bk.parse_timestamps(raw['Start Time']), repeat),
+    }
+    return timings
+
+
+def bench_render(rows=100000, repeat=20, seed=0):
+    """
+    Measures the render step of each stats tab: the time to build its output
+    components and the size of the JSON payload sent to the browser.
+
+    Args:
+        (int) rows - number of rows of the synthetic data, filtered to one month and weekday
+        (int) repeat - number of runs per tab (the fastest one is reported)
+        (int) seed - seed of the synthetic data
+    Returns:
+        (dict) results - {tab: {'seconds', 'bytes'}}
+    """
+    df = bk.prepare_city_data(synthetic_city_data(rows, seed))
+    summary = cube.summarize(df[(df['Month'] == 'June') & (df['Weekday'] == 'Friday')])
+    renderers = {'time': lambda: bk.time_stats(summary),
+                 'station': lambda: bk.station_stats(summary),
+                 'trip': lambda: bk.trip_duration_stats(summary),
+                 'user': lambda: bk.user_stats(summary, 'chicago'),
+                 'riders': lambda: bk.station_riders_stats(summary)}
+    results = {}
+    for tab, render in renderers.items():
+        payload = json.dumps(render(), cls=plotly.utils.PlotlyJSONEncoder)
+        results[tab] = {'seconds': best_time(render, repeat), 'bytes': len(payload)}
+    return results
+
+
+def bench_shards(rows, workers, data_dir, repeat=3, seed=0):
+    """
+    Compares building a city cube and summarizing an hour window selection in
+    this process with the sharded mode (bk.SHARD_WORKERS) for each number of
+    worker processes, checking that every mode gives the same stats.
+
+    Args:
+        (int) rows - number of rows of the synthetic chicago file
+        (list) workers - numbers of shard workers to measure
+        (str) data_dir - where the synthetic data files are generated and kept
+    Returns:
+        (dict) timings - {mode: {'cube': seconds, 'summary': seconds}}
+    """
+    path = os.path.join(data_dir, "chicago_{}_{}.csv".format(rows, seed))
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print("Generating {}...".format(path))
+        write_city_csv(path, rows, seed)
+
+    def cold_cube():
+        bk.CUBE_CACHE.clear()
+        cube_file = os.path.join(bk.CACHE_DIR, 'chicago.cube.pkl')
+        if os.path.exists(cube_file):
+            os.remove(cube_file)
+        return bk.load_city_cube('chicago')
+
+    def hour_summary():
+        return bk.load_summary('chicago', 'none', 'none', hours=(7, 9))
+
+    timings = {}
+    expected = None
+    city_data, cache_dir, shard_workers = bk.CITY_DATA, bk.CACHE_DIR, bk.SHARD_WORKERS
+    try:
+        bk.CITY_DATA = dict(bk.CITY_DATA, chicago=path)
+        bk.CACHE_DIR = os.path.join(data_dir, "cache_{}_shards".format(rows))
+        for num_workers in [0] + list(workers):
+            bk.SHARD_WORKERS = num_workers
+            bk.SHARD_POOL = None
+            reset_caches()
+            # Loads the city data (and writes its column store file) before timing
+            bk.load_city_data('chicago')
+            mode = 'single process' if num_workers == 0 else "{} workers".format(num_workers)
+            timings[mode] = {'cube': best_time(cold_cube, repeat), 'summary': best_time(hour_summary, repeat)}
+            stats = json.dumps([bk.all_stats_data(cube.query_cube(cold_cube(), 'none', 'none')),
+                                bk.all_stats_data(hour_summary())], default=str)
+            if expected is None:
+                expected = stats
+            elif stats != expected:
+                print("WARNING: the stats computed with {} differ from the single process stats".format(mode))
+            if bk.SHARD_POOL is not None:
+                bk.SHARD_POOL.shutdown()
+    finally:
+        bk.CITY_DATA, bk.CACHE_DIR, bk.SHARD_WORKERS = city_data, cache_dir, shard_workers
+        bk.SHARD_POOL = None
+        reset_caches()
+    return timings
+
+
+def print_timings(title, timings, rows):
+    """ Prints benchmark timings with their throughput """
+    print(title)
+    for name, seconds in timings.items():
+        print("  {:<32} {:>9.4f} s {:>14,.0f} rows/s".format(name, seconds, rows / seconds))
+
+
+# Main Function
+# #############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="US bikeshare performance benchmarks")
+    parser.add_argument('benchmark', choices=['suite', 'timestamps', 'render', 'shards'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES,
+                        help="data file sizes (rows) of the suite")
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help="data file size (rows) of the timestamps and shards benchmarks")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="numbers of worker processes of the shards benchmark")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'bikeshare_bench'),
+                        help="where the synthetic data files are generated and kept")
+    parser.add_argument('--baseline', default='bench_baseline.json',
+                        help="results file to compare against")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument('--min-seconds', type=float, default=REGRESSION_MIN_SECONDS,
+                        help="slowdowns below this many seconds are never flagged")
+    args = parser.parse_args()
+
+    if args.benchmark == 'render':
+        print("{:<10} {:>10} {:>10}".format('tab', 'ms', 'bytes'))
+        for tab, result in bench_render(repeat=max(args.repeat, 20), seed=args.seed).items():
+            print("{:<10} {:>10.3f} {:>10,}".format(tab, result['seconds'] * 1000, result['bytes']))
+    elif args.benchmark == 'shards':
+        timings = bench_shards(args.rows, args.workers, args.data_dir, args.repeat, args.seed)
+        single = timings['single process']
+        print("{:<16} {:>10} {:>8} {:>12} {:>8}".format('mode', 'cube s', 'speedup', 'summary s', 'speedup'))
+        for mode, result in timings.items():
+            print("{:<16} {:>10.4f} {:>7.2f}x {:>12.4f} {:>7.2f}x".format(
+                  mode, result['cube'], single['cube'] / result['cube'],
+                  result['summary'], single['summary'] / result['summary']))
+    elif args.benchmark == 'timestamps':
+        print_timings("Timestamp parsing, {:,} rows:".format(args.rows),
+                      bench_timestamps(args.rows, args.repeat), args.rows)
+    else:
+        baseline = None
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+
+        results = run_suite(args.sizes, args.data_dir, args.repeat, args.seed)
+        print_results(results, baseline)
+
+        if args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+            print("Baseline saved to {}".format(args.baseline))
+        elif baseline:
+            regressions = compare_to_baseline(results, baseline, args.tolerance, args.min_seconds)
+            for name, before, after in regressions:
+                print("REGRESSION: {} took {:.4f} s (baseline {:.4f} s)".format(name, after, before))
+            if regressions:
+                raise SystemExit(1)
@@ -0,0 +1,140 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_columns.py' writes prepared city data as a column store
+#         file and reads it back memory-mapped, so that every worker process
+#         shares a single (page cache) copy of the data
+# #############################################################################
+
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+
+# Global variables and data structures
+# First bytes of a column store file, followed by the length of the header
+MAGIC = b'BKCOLS01'
+
+# Every column starts at a multiple of this many bytes of the file
+ALIGNMENT = 64
+
+
+# #############################################################################
+# Function definitions
+def codes_dtype(num_categories):
+    """
+    Returns the integer type pandas uses for the codes of a categorical with
+    this many categories, so the mapped codes can be used without a copy
+    """
+    for dtype in [np.int8, np.int16, np.int32]:
+        if num_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def aligned(offset):
+    """ Rounds a file offset up to the next multiple of ALIGNMENT """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def encode_column(series):
+    """
+    Converts a column to a fixed width array. Strings are dictionary encoded:
+    the array holds their integer codes (-1 for missing values) and the
+    distinct values (the dictionary) go in the column description.
+
+    Args:
+        (pd.Series) series - column of prepared city data
+    Returns:
+        (tuple) values, description - np.array to write and the header entry of the column
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        codes = np.asarray(series.cat.codes)
+    elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+        codes, categories = pd.factorize(series, sort=True)
+    else:
+        values = np.ascontiguousarray(series.values)
+        return values, {'name': series.name, 'dtype': values.dtype.str}
+
+    dtype = codes_dtype(len(categories))
+    return codes.astype(dtype), {'name': series.name,
+                                 'dtype': dtype.str,
+                                 'categories': pd.Index(categories).tolist(),
+                                 'ordered': bool(getattr(series.dtype, 'ordered', False))}
+
+
+def write_column_store(path, df):
+    """
+    Writes a DataFrame as a column store file: the magic bytes, the header
+    length, the JSON header describing the columns, then the aligned columns.
+    The file is written under a temporary name first so readers never see a
+    partial file, and readers that still map the old file keep their copy.
+
+    Args:
+        (str) path - file to write
+        (pd.DataFrame) df - prepared city data
+    """
+    arrays = []
+    descriptions = []
+    for column in df.columns:
+        values, description = encode_column(df[column])
+        arrays.append(values)
+        descriptions.append(description)
+
+    # Column offsets are relative to the start of the data, the first aligned
+    # position after the header
+    offset = 0
+    for values, description in zip(arrays, descriptions):
+        description['offset'] = offset
+        offset = aligned(offset + values.nbytes)
+    header_bytes = json.dumps({'rows': len(df), 'columns': descriptions}).encode()
+    data_start = aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for values, description in zip(arrays, descriptions):
+            f.write(b'\0' * (data_start + description['offset'] - f.tell()))
+            f.write(values.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_column_store(path):
+    """
+    Opens a column store file memory-mapped (read only) and returns its data as
+    a DataFrame whose columns are views of the mapping, so nothing is copied:
+    the operating system loads the pages when they are used and shares them
+    between all the processes that map the file.
+
+    Args:
+        (str) path - file written by write_column_store()
+    Returns:
+        df - Pandas DataFrame backed by the mapped file
+    """
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(mapped[:len(MAGIC)]) != MAGIC:
+        raise ValueError("{} is not a column store file".format(path))
+    header_start = len(MAGIC) + 8
+    header_size = int(mapped[len(MAGIC):header_start].view(np.uint64)[0])
+    header = json.loads(bytes(mapped[header_start:header_start + header_size]))
+
+    rows = header['rows']
+    data_start = aligned(header_start + header_size)
+    columns = {}
+    for description in header['columns']:
+        dtype = np.dtype(description['dtype'])
+        offset = data_start + description['offset']
+        values = mapped[offset:offset + rows * dtype.itemsize].view(dtype)
+        if 'categories' in description:
+            columns[description['name']] = pd.Categorical.from_codes(values, categories=description['categories'],
+                                                                      ordered=description['ordered'],
+                                                                      validate=False)
+        else:
+            columns[description['name']] = pd.Series(values, copy=False)
+    return pd.DataFrame(columns, copy=False)
+# #############################################################################
@@ -0,0 +1,433 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_cube.py' builds and queries the precomputed aggregate cube
+# #############################################################################
+
+import numpy as np
+import pandas as pd
+import bikeshare_sketch as sketch
+
+
+# Global variables and data structures
+# Every filter offered by the UI is a (month, weekday) pair, so all the
+# aggregates are broken down by these two columns first
+FILTER_DIMS = ['Month', 'Weekday']
+
+# Columns counted jointly with the filter columns in the main count table
+COUNT_DIMS = ['Hour', 'User Type', 'Gender']
+
+# Columns counted separately (one count table each) with the filter columns
+VALUE_DIMS = ['Start Station', 'End Station', 'Birth Year']
+
+# Station pair of a trip
+TRIP_DIMS = ['Start Station', 'End Station']
+
+# Trip duration distribution, counted with the filter columns: the log bucket
+# of the duration (a mergeable quantile sketch, see bikeshare_sketch.py) and
+# its bin of the duration histogram
+DURATION_DIMS = ['Duration Bucket', 'Duration Bin']
+
+# Relative accuracy of the trip duration quantiles
+DURATION_ACCURACY = 0.01
+
+# Lower edges (in seconds) of the bins of the duration histogram; the last bin is open ended
+DURATION_BIN_EDGES = [0, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200, 10800, 21600, 86400]
+DURATION_BIN_LABELS = ['< 5 min', '5-10 min', '10-15 min', '15-20 min', '20-30 min', '30-45 min', '45-60 min',
+                       '1-1.5 h', '1.5-2 h', '2-3 h', '3-6 h', '6-24 h', '>= 24 h']
+
+# Riders of each start station: trips counted jointly by start station, user
+# type, gender and decade of birth (with the filter columns), in one table
+STATION_RIDER_DIMS = ['Start Station', 'User Type', 'Gender', 'Birth Decade']
+
+# Combined code spaces up to this many bins are counted with np.bincount;
+# larger ones (e.g. month x weekday x station pairs) fall back to np.unique
+MAX_BINCOUNT_BINS = 2 ** 24
+
+
+# #############################################################################
+# Function definitions
+def encode_column(series):
+    """
+    Encodes a column as integer codes, the single pass made over each column.
+
+    Args:
+        (pd.Series) series - column to encode
+    Returns:
+        (tuple) codes, uniques - np.array of codes (-1 for missing values) and
+                                 the pd.Index of the sorted distinct values
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return np.asarray(series.cat.codes), series.cat.categories
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def encode_frame(df, columns):
+    """ Encodes the given columns of a DataFrame, skipping missing columns """
+    return {column: encode_column(df[column]) for column in columns if column in df.columns}
+
+
+def encode_values(values):
+    """
+    Encodes an array of small non negative integers, like encode_column() (-1
+    stays missing), through a lookup table from value to code instead of a sort
+    """
+    present = np.bincount(values + 1)[1:] > 0
+    uniques = np.flatnonzero(present)
+    # Entry 0 of the table is for the missing values
+    table = np.full(len(present) + 1, -1, dtype=np.int64)
+    table[uniques + 1] = np.arange(len(uniques))
+    return table[values + 1], pd.Index(uniques)
+
+
+def encode_durations(durations):
+    """
+    Encodes the log bucket and the histogram bin of each trip duration
+
+    Args:
+        (np.array) durations - trip durations in seconds (NaN for missing ones)
+    Returns:
+        (dict) encoded - {column: (codes, uniques)} of the DURATION_DIMS columns
+    """
+    buckets = sketch.log_bucket_codes(durations, DURATION_ACCURACY)
+    # The bin edges are multiples of a common step, so the bin of each step
+    # is looked up in a table instead of searching the edges for every trip
+    step = int(np.gcd.reduce(DURATION_BIN_EDGES))
+    bin_table = np.searchsorted(DURATION_BIN_EDGES, np.arange(0, DURATION_BIN_EDGES[-1] + step, step), side='right') - 1
+    missing = np.isnan(durations)
+    # Negative durations go to the first bin and the longest ones to the last
+    steps = np.clip(durations / step, 0, len(bin_table) - 1)
+    steps[missing] = 0
+    bins = bin_table[steps.astype(np.int64)]
+    bins[missing] = -1
+    return {'Duration Bucket': encode_values(buckets),
+            'Duration Bin': encode_values(bins)}
+
+
+def encode_birth_decades(birth_years):
+    """
+    Encodes the decade of each birth year, like encode_column() (the uniques
+    are the first years of the decades, e.g. 1980)
+    """
+    birth_years = np.asarray(birth_years, dtype=np.float64)
+    missing = np.isnan(birth_years) | (birth_years < 0)
+    decades = (np.where(missing, -10, birth_years) // 10).astype(np.int64)
+    codes, uniques = encode_values(decades)
+    return codes, uniques * 10
+
+
+def grouped_counts(encoded, columns, dropna=True):
+    """
+    Counts the combinations of already encoded columns, like df.groupby(columns).size(),
+    by combining the codes into one integer per row and counting those.
+
+    Args:
+        (dict) encoded - {column: (codes, uniques)} as returned by encode_frame()
+        (list) columns - columns to group by
+        (bool) dropna - whether rows with a missing value are left out
+    Returns:
+        (pd.Series) counts - non-zero counts indexed by the column values
+    """
+    codes = [encoded[column][0] for column in columns]
+    levels = [encoded[column][1] for column in columns]
+    if dropna:
+        keep = np.logical_and.reduce([c >= 0 for c in codes])
+        codes = [c[keep] for c in codes]
+
+    # Shift the codes by one so missing values (-1) get their own bin
+    shape = tuple(len(level) + 1 for level in levels)
+    flat = np.ravel_multi_index([c.astype(np.int64) + 1 for c in codes], shape)
+    size = int(np.prod(shape, dtype=np.int64))
+    if size <= MAX_BINCOUNT_BINS:
+        bin_counts = np.bincount(flat, minlength=size)
+        flat = np.flatnonzero(bin_counts)
+        counts = bin_counts[flat]
+    else:
+        flat, counts = np.unique(flat, return_counts=True)
+
+    index_codes = [c - 1 for c in np.unravel_index(flat, shape)]
+    index = pd.MultiIndex(levels=levels, codes=index_codes, names=columns, verify_integrity=False)
+    if len(columns) == 1:
+        index = index.get_level_values(0)
+    return pd.Series(counts, index=index)
+
+
+def grouped_sums(encoded, columns, values):
+    """
+    Sums and counts the non missing values per combination of already encoded columns,
+    like df.groupby(columns)[column].agg(['sum', 'count']).
+
+    Args:
+        (dict) encoded - {column: (codes, uniques)} as returned by encode_frame()
+        (list) columns - columns to group by (rows with a missing value are left out)
+        (np.array) values - values to sum, aligned with the encoded rows
+    Returns:
+        (pd.DataFrame) sums - 'sum' and 'count' columns indexed by the column values
+    """
+    codes = [encoded[column][0] for column in columns]
+    levels = [encoded[column][1] for column in columns]
+    keep = np.logical_and.reduce([c >= 0 for c in codes]) & ~np.isnan(values)
+    shape = tuple(len(level) for level in levels)
+    flat = np.ravel_multi_index([c[keep] for c in codes], shape)
+    size = int(np.prod(shape, dtype=np.int64))
+    counts = np.bincount(flat, minlength=size)
+    sums = np.bincount(flat, weights=values[keep], minlength=size)
+
+    flat = np.flatnonzero(counts)
+    index_codes = np.unravel_index(flat, shape)
+    index = pd.MultiIndex(levels=levels, codes=index_codes, names=columns, verify_integrity=False)
+    return pd.DataFrame({'sum': sums[flat], 'count': counts[flat]}, index=index)
+
+
+def build_cube(df):
+    """
+    Builds the aggregate cube of a prepared city DataFrame.
+    Each column is encoded once and every count table is built from the codes.
+
+    Args:
+        (pd.DataFrame) df - prepared city data, with 'Month', 'Weekday' and 'Hour' columns
+    Returns:
+        (dict) cube - count Series indexed by the filter columns plus the counted columns
+                      (the duration buckets and bins, and the station riders included),
+                      and the sum/count of the trip durations per filter combination
+    """
+    cube = {}
+    encoded = encode_frame(df, FILTER_DIMS + COUNT_DIMS + VALUE_DIMS)
+    count_dims = FILTER_DIMS + [c for c in COUNT_DIMS if c in encoded]
+    # Keep missing genders, so the row totals of the cube match the data
+    cube['counts'] = grouped_counts(encoded, count_dims, dropna=False)
+
+    for column in VALUE_DIMS:
+        if column in encoded:
+            cube[column] = grouped_counts(encoded, FILTER_DIMS + [column])
+
+    cube['Trip'] = grouped_counts(encoded, FILTER_DIMS + TRIP_DIMS)
+    durations = df['Trip Duration'].values.astype(np.float64)
+    cube['Trip Duration'] = grouped_sums(encoded, FILTER_DIMS, durations)
+    encoded.update(encode_durations(durations))
+    for column in DURATION_DIMS:
+        cube[column] = grouped_counts(encoded, FILTER_DIMS + [column])
+
+    if 'Birth Year' in df.columns:
+        encoded['Birth Decade'] = encode_birth_decades(df['Birth Year'].values)
+    # Keep missing values, so the station totals match the data
+    cube['Station Riders'] = grouped_counts(encoded, FILTER_DIMS + [c for c in STATION_RIDER_DIMS if c in encoded],
+                                            dropna=False)
+    return cube
+
+
+def summarize(df):
+    """
+    Computes the summary of a DataFrame directly (without a cube), making one
+    pass over each column, for data that is not covered by a city cube.
+
+    Args:
+        (pd.DataFrame) df - prepared (and possibly filtered) city data
+    Returns:
+        (dict) summary - same layout as the summary returned by query_cube()
+    """
+    summary = {}
+    encoded = encode_frame(df, FILTER_DIMS + COUNT_DIMS + VALUE_DIMS)
+    encoded.update(encode_durations(df['Trip Duration'].values.astype(np.float64)))
+    for column in FILTER_DIMS + COUNT_DIMS + VALUE_DIMS + DURATION_DIMS:
+        if column in encoded:
+            summary[column] = grouped_counts(encoded, [column])
+    summary['Trip'] = grouped_counts(encoded, TRIP_DIMS)
+    if 'Birth Year' in df.columns:
+        encoded['Birth Decade'] = encode_birth_decades(df['Birth Year'].values)
+    summary['Station Riders'] = grouped_counts(encoded, [c for c in STATION_RIDER_DIMS if c in encoded],
+                                               dropna=False)
+    # Accumulate in float64, the durations may be stored as float32
+    summary['Trip Duration'] = {'sum': np.nansum(df['Trip Duration'].values, dtype=np.float64),
+                                'count': int(df['Trip Duration'].count())}
+    summary['rows'] = len(df)
+    return summary
+
+
+def merge_cubes(cubes):
+    """
+    Merges cubes built from disjoint parts of the same city data (e.g. chunks
+    of its csv file) into the cube of the whole data, by adding their counts.
+
+    Args:
+        (list) cubes - cubes built by build_cube()
+    Returns:
+        (dict) cube - the merged cube
+    """
+    merged = {}
+    for key in cubes[0]:
+        combined = pd.concat([c[key] for c in cubes if key in c])
+        merged[key] = combined.groupby(level=combined.index.names, dropna=False).sum()
+    return merged
+
+
+def cube_bytes(cube):
+    """
+    Returns the memory used by a cube in bytes. The trip and station rider
+    tables grow with the number of distinct station pairs, so a cube is not
+    small next to the city data it was built from.
+    """
+    return int(sum(np.sum(counts.memory_usage(index=True, deep=True)) for counts in cube.values()))
+
+
+def merge_summaries(summaries):
+    """
+    Merges summaries of disjoint parts of the same data (e.g. shards of a city
+    frame) into the summary of the whole data, by adding their counts and totals.
+    The counts are exact; the trip duration total may differ from a single pass
+    in the last digits, as floating point additions are made in another order.
+
+    Args:
+        (list) summaries - summaries returned by summarize()
+    Returns:
+        (dict) summary - the merged summary
+    """
+    merged = {}
+    for key, value in summaries[0].items():
+        if isinstance(value, pd.Series):
+            combined = pd.concat([s[key] for s in summaries])
+            merged[key] = combined.groupby(level=combined.index.names, dropna=False).sum()
+        elif key == 'Trip Duration':
+            merged[key] = {'sum': sum(s[key]['sum'] for s in summaries),
+                           'count': sum(s[key]['count'] for s in summaries)}
+        else:
+            merged[key] = sum(s[key] for s in summaries)
+    return merged
+
+
+def filter_mask(index, month, weekday):
+    """
+    Returns a boolean mask of the cube index entries matching the filters
+
+    Args:
+        (pd.MultiIndex) index - cube index with 'Month' and 'Weekday' levels
+        (str) month - name (or list of names) of the month(s) to filter by, or 'none'
+        (str) weekday - name (or list of names) of the day(s) of week to filter by, or 'none'
+    """
+    mask = np.ones(len(index), dtype=bool)
+    for level, value in [('Month', month), ('Weekday', weekday)]:
+        values = [value] if isinstance(value, str) else value
+        if values and values != ['none']:
+            mask &= index.get_level_values(level).isin([v.title() for v in values])
+    return mask
+
+
+def sum_slice(counts, month, weekday, levels):
+    """
+    Sums the cube entries matching the filters, grouped by the given index level(s)
+    """
+    counts = counts[filter_mask(counts.index, month, weekday)]
+    return counts.groupby(level=levels, dropna=False, observed=True).sum()
+
+
+def query_cube(cube, month, weekday):
+    """
+    Answers a (month, weekday) filter from the cube.
+
+    Args:
+        (dict) cube - cube built by build_cube()
+        (str) month - name(s) of the month(s) to filter by, or 'none'
+        (str) weekday - name(s) of the day(s) of week to filter by, or 'none'
+    Returns:
+        (dict) summary - count Series of each stats column (missing values excluded),
+                         station pair counts under 'Trip', the trip duration total
+                         and count under 'Trip Duration', the counts of the duration
+                         buckets and bins under DURATION_DIMS, the cube entries of the
+                         station riders matching the filters under 'Station Riders',
+                         and the row count under 'rows'
+    """
+    summary = {}
+    counts = cube['counts']
+    for column in FILTER_DIMS + COUNT_DIMS:
+        if column in counts.index.names:
+            column_counts = sum_slice(counts, month, weekday, column)
+            summary[column] = column_counts[column_counts.index.notna()]
+
+    for column in VALUE_DIMS + DURATION_DIMS:
+        if column in cube:
+            summary[column] = sum_slice(cube[column], month, weekday, column)
+
+    summary['Trip'] = sum_slice(cube['Trip'], month, weekday, TRIP_DIMS)
+    # Left unsummed: count_matrix() sums the slice directly into station tables
+    station_riders = cube['Station Riders']
+    summary['Station Riders'] = station_riders[filter_mask(station_riders.index, month, weekday)]
+
+    duration = cube['Trip Duration']
+    duration = duration[filter_mask(duration.index, month, weekday)]
+    summary['Trip Duration'] = {'sum': duration['sum'].sum(),
+                                'count': int(duration['count'].sum())}
+    summary['rows'] = int(counts[filter_mask(counts.index, month, weekday)].sum())
+    return summary
+
+
+def count_matrix(counts, row_level, column_level=None):
+    """
+    Sums counts indexed by several columns into a table of the values of two of
+    them, with one grouped bincount over the codes of the two index levels.
+    Entries with a missing value are left out (merged counts may hold them as
+    NaN index values), and so are the values without counts.
+
+    Args:
+        (pd.Series) counts - counts with a MultiIndex, e.g. the station riders
+        (str) row_level - index level giving the rows of the table
+        (str) column_level - index level giving the columns, or None for a
+                             single 'Count' column of the row totals
+    Returns:
+        (pd.DataFrame) table - int64 counts indexed by the row values
+    """
+    index = counts.index
+    rows = index.codes[index.names.index(row_level)]
+    row_values = index.levels[index.names.index(row_level)]
+    if column_level is None:
+        columns = np.zeros(len(rows), dtype=np.int64)
+        column_values = pd.Index(['Count'])
+    else:
+        columns = index.codes[index.names.index(column_level)]
+        column_values = index.levels[index.names.index(column_level)]
+
+    keep = (rows >= 0) & (columns >= 0)
+    shape = (len(row_values), len(column_values))
+    flat = np.ravel_multi_index((rows[keep].astype(np.int64), columns[keep].astype(np.int64)), shape)
+    matrix = np.bincount(flat, weights=counts.values[keep], minlength=shape[0] * shape[1]).reshape(shape)
+    table = pd.DataFrame(matrix.astype(np.int64), index=row_values, columns=column_values)
+    return table.loc[matrix.any(axis=1) & row_values.notna(), matrix.any(axis=0) & column_values.notna()]
+
+
+def describe_counts(counts):
+    """
+    Describes a distribution from its counts, computing all its stats together.
+
+    Args:
+        (pd.Series) counts - counts indexed by value
+    Returns:
+        (dict) description - 'mode' (ties go to the smallest value, like pd.Series.mode()),
+                             its 'count', the 'counts' sorted by decreasing count and
+                             their 'percent' of the total, rounded to 2 decimals
+    """
+    counts = counts.sort_index().sort_values(ascending=False, kind='stable')
+    return {'mode': counts.index[0],
+            'count': counts.iloc[0],
+            'counts': counts,
+            'percent': (counts / counts.sum() * 100).round(2)}
+
+
+def top_value(counts):
+    """
+    Returns the most common value of a count Series and its count.
+    """
+    description = describe_counts(counts)
+    return description['mode'], description['count']
+
+
+def top_values(counts, k):
+    """
+    Returns the k most common values of a count Series, ordered like describe_counts()
+    (ties go to the smallest value). Only the counts that can make the top k are
+    sorted, which matters for the large station pair counts.
+    """
+    if len(counts) > k:
+        threshold = np.partition(counts.values, len(counts) - k)[len(counts) - k]
+        counts = counts[counts.values >= threshold]
+    return counts.sort_index().sort_values(ascending=False, kind='stable').head(k)
+# #############################################################################
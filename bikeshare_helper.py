@@ -4,13 +4,33 @@
 #   File: 'bikeshare_helper.py' contains all the helper functions
 # #############################################################################
 
+import os
+import json
 import time
+import hashlib
+import calendar
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import dash_table
+import dash_html_components as html
 import dash_bootstrap_components as dbc
-import plotly.express as px
+import plotly
+import bikeshare_cube as cube
+import bikeshare_columns as column_store
+import bikeshare_sketch as sketch
+import bikeshare_shards as sharding
+import bikeshare_results as results
+import bikeshare_metrics as metrics
 
+# Parquet is the preferred format for the city data cache; fall back to
+# pickle files (which also keep the column dtypes) if pyarrow is missing
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
 
 # Global variables and data structures
 # Data File Dictionary
@@ -18,56 +38,995 @@ CITY_DATA = {'chicago': 'chicago.csv',
              'nyc': 'new_york_city.csv',
              'washington': 'washington.csv'}
 
-# City Name: required to conditionally display additional user stats
-# Loaded after user filter selections
-CITY = ""
+# Shown by every tab instead of its stats when no trips match the filters
+# (e.g. a month outside of the date range)
+NO_TRIPS_TEXT = "No trips match the selected filters."
 
-# Counter to keep track of the rows of raw data to display
-ROW_COUNTER = 0
+# Number of rows of raw data to display at a time
+# (the per-user page of raw data is kept in the session state, see bikeshare_session.py)
 ROW_ADVANCE = 5
 
-# Main DataFrame
-# Loaded after user filter selections
-DF = pd.DataFrame()
+# Directory holding the converted (columnar) copies of the city data files.
+# A copy is rebuilt whenever the source csv file's mtime or size changes.
+CACHE_DIR = 'cache'
 
+# Version of the prepared data layout, part of the cache signature so that
+# cached copies written by an older version are rebuilt
+CACHE_VERSION = 5
+
+# New trip data can be added to a city by dropping csv files (in the layout of
+# the city data file) into DELTA_DIR/<city>/. They are ingested in file name
+# order, and only the files not ingested yet are parsed on the next load.
+DELTA_DIR = 'deltas'
+
+# The rows of new delta files are cached as segment files next to the cached
+# copy of the city, so a refresh writes the new rows only. Past this many
+# segments the cached copy is rewritten as one file again. The column store
+# format is always one file, as the worker processes map it and shard it by row ranges.
+MAX_CACHE_SEGMENTS = 8
+
+# Memory cap (in MB) of the in-process cache of prepared city DataFrames
+FRAME_CACHE_MAX_MB = 1024
+
+# Memory cap (in MB) of the in-process cache of city cubes
+CUBE_CACHE_MAX_MB = 256
+
+# Opt-in compact schema for the prepared city data: categorical string
+# columns, int8 calendar codes and float32 numbers (see compact_frame())
+COMPACT_DTYPES = False
+
+# Streaming ingestion mode: filtered loads read the csv file in chunks of
+# CHUNK_SIZE rows and keep only the matching rows, and the city cube is built
+# chunk by chunk, so peak memory follows the filtered result instead of the
+# whole file. The full city frame is then never loaded into the frame cache.
+STREAMING_INGEST = False
+CHUNK_SIZE = 500000
+
+# Memory cap (in MB) of the cache of the filtered frames read in streaming
+# mode, so paging through the raw data of a selection reads the csv file once
+STREAM_CACHE_MAX_MB = 256
+
+# Shared column store mode, for deployments with several worker processes:
+# the city data cache is written as a column store file (see
+# bikeshare_columns.py) that every worker maps into memory instead of reading
+# its own copy, so the city frames live once in the shared page cache and
+# adding workers does not multiply the memory used
+SHARED_COLUMNS = False
+
+# Sharded execution mode, for hosts with many cores: with SHARD_WORKERS set,
+# the city cubes and the summaries of date range and hour selections are
+# computed as partial aggregates of shards of the city data in a pool of
+# SHARD_WORKERS processes, then merged. Shards are row ranges (SHARDS_PER_WORKER
+# per worker, so uneven shards even out) or, with SHARD_BY = 'month', one
+# month each, which skips the months filtered out. The workers map the city
+# data from its column store file, so the city data cache is kept in that format
+SHARD_WORKERS = 0
+SHARD_BY = 'rows'
+SHARDS_PER_WORKER = 4
+
+# Layout of the 'Start Time' and 'End Time' values in the city data files,
+# used for fast parsing (files with another layout fall back to inference)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Worker threads computing the tabs of a request concurrently (the pandas and
+# NumPy kernels release the GIL for most of their work)
+PIPELINE_THREADS = 4
+
+# The app only computes the tab the user is looking at; with PREFETCH_TABS the
+# other tabs of the selection are then computed in the background, on
+# PREFETCH_THREADS threads, into the result cache, so they show up at once
+PREFETCH_TABS = True
+PREFETCH_THREADS = 1
+
+# A request for a tab being prefetched (by any process) waits up to this many
+# seconds for the prefetch instead of computing the tab again
+PREFETCH_WAIT_SECONDS = 60
+
+# The outputs of each filter selection are cached for RESULT_CACHE_TTL
+# seconds, in memory and under CACHE_DIR/results (shared by the worker
+# processes), for up to RESULT_CACHE_MAX_ENTRIES selections. The key includes
+# a fingerprint of the city data files, so changed data is never served stale.
+RESULT_CACHE_TTL = 60 * 60
+RESULT_CACHE_MAX_ENTRIES = 512
+
+# Number of most popular trips (station pairs) listed in the station tab
+TOP_ROUTES = 5
+
+# Size of the approximate top trips summaries of stream_top_routes(): the
+# number of counters kept, and the Count-Min sketch error (epsilon * rows,
+# exceeded with probability delta)
+HEAVY_HITTER_COUNTERS = 1000
+COUNT_MIN_EPSILON = 0.0001
+COUNT_MIN_DELTA = 0.01
+
+# Percentiles of the trip duration shown in the trip tab, estimated from the
+# duration sketches of the cube (see bikeshare_cube.DURATION_ACCURACY)
+DURATION_PERCENTILES = [0.5, 0.9, 0.99]
+
+# Categories of the compact 'Month' and 'Weekday' columns, in calendar order
+MONTH_NAMES = list(calendar.month_name)[1:]
+WEEKDAY_NAMES = list(calendar.day_name)
 
 
 # #############################################################################
 # Function definitions
-def load_data(city, month, weekday):
+def parse_timestamps(series):
+    """
+    Converts a column of timestamp strings to datetime, using the known layout
+    of the bikeshare files and falling back to format inference if it doesn't match.
+
+    Args:
+        (pd.Series) series - timestamp strings (or already converted datetimes)
+    Returns:
+        (pd.Series) datetimes - the converted column
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        return pd.to_datetime(series, format=TIMESTAMP_FORMAT, cache=True)
+    except (ValueError, TypeError):
+        return pd.to_datetime(series, cache=True)
+
+
+def end_times(df):
+    """
+    Returns the 'End Time' column of prepared city data as datetimes.
+    'End Time' is kept as text by prepare_city_data() since none of the stats use it,
+    so it is only converted when (and where) something needs it.
+    """
+    return parse_timestamps(df['End Time'])
+
+
+def prepare_city_data(df, compact=None):
+    """
+    Converts the raw csv columns and adds the derived columns used by the stats.
+
+    Args:
+        (pd.DataFrame) df - city data as read from the csv file
+        (bool) compact - whether to use the compact schema, defaults to COMPACT_DTYPES
+    Returns:
+        df - Pandas DataFrame with datetime columns and 'Month', 'Weekday' and 'Hour'
+    """
+    # Convert start times to datetime ('End Time' is converted lazily, see end_times())
+    df['Start Time'] = parse_timestamps(df['Start Time'])
+
+    # Create three new columns, 'Month', 'Weekday' and 'Hour'
+    # based one the 'Start Time' column. 'Month' and 'Weekday' are categoricals
+    # in calendar order, so their codes serve as precomputed filter codes
+    df['Month'] = pd.Categorical(df['Start Time'].dt.month_name(), categories=MONTH_NAMES)
+    df['Weekday'] = pd.Categorical(df['Start Time'].dt.day_name(), categories=WEEKDAY_NAMES)
+    df['Hour'] = df['Start Time'].dt.hour
+
+    if COMPACT_DTYPES if compact is None else compact:
+        df = compact_frame(df)
+    return df
+
+
+def sort_by_time(df):
+    """
+    Sorts prepared city data by 'Start Time' (keeping the file order of equal
+    times), so date ranges can be found by binary search, see time_slice()
+    """
+    if df['Start Time'].is_monotonic_increasing:
+        return df
+    return df.sort_values('Start Time', kind='stable', ignore_index=True)
+
+
+def compact_frame(df):
+    """
+    Converts prepared city data to the compact schema: categoricals for the
+    station, user type and gender columns, categoricals with int8 codes for
+    'Month' and 'Weekday', int8 for 'Hour' and float32 for the numbers.
+    The values (and the filters and stats computed on them) do not change.
+
+    Args:
+        (pd.DataFrame) df - prepared city data
+    Returns:
+        df - Pandas DataFrame using the compact schema
+    """
+    for column in ['Start Station', 'End Station', 'User Type', 'Gender']:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    df['Month'] = pd.Categorical(df['Month'], categories=MONTH_NAMES)
+    df['Weekday'] = pd.Categorical(df['Weekday'], categories=WEEKDAY_NAMES)
+    df['Hour'] = df['Hour'].astype(np.int8)
+    for column in ['Trip Duration', 'Birth Year']:
+        if column in df.columns:
+            df[column] = df[column].astype(np.float32)
+    return df
+
+
+def memory_report(df):
+    """
+    Compares the memory used by each column of prepared city data in the
+    default and the compact schema.
+
+    Args:
+        (pd.DataFrame) df - city data prepared with compact=False
+    Returns:
+        (pd.DataFrame) report - bytes per column in each schema and their ratio,
+                                with a 'Total' row
+    """
+    compact_df = compact_frame(df.copy())
+    report = pd.DataFrame({'default': df.memory_usage(deep=True, index=False),
+                           'compact': compact_df.memory_usage(deep=True, index=False)})
+    report.loc['Total'] = report.sum()
+    report['ratio'] = (report['default'] / report['compact']).round(1)
+    return report
+
+
+def cache_format():
+    """ Returns the format of the city data cache: 'columns', 'parquet' or 'pickle' """
+    return 'columns' if SHARED_COLUMNS or SHARD_WORKERS else CACHE_FORMAT
+
+
+def source_signature(path):
+    """
+    Returns the mtime and size of a source data file, used to check cache freshness.
+    """
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'format': cache_format(),
+            'compact': COMPACT_DTYPES, 'version': CACHE_VERSION}
+
+
+def delta_files(city):
+    """ Returns the paths of the delta files of a city, in ingestion order """
+    delta_dir = os.path.join(DELTA_DIR, city)
+    if not os.path.isdir(delta_dir):
+        return []
+    return [os.path.join(delta_dir, name) for name in sorted(os.listdir(delta_dir)) if name.endswith('.csv')]
+
+
+def data_signature(city):
+    """
+    Returns the signature of all the data of a city: the signature of its data
+    file, plus the mtime and size of each of its delta files under 'deltas'.
+    """
+    signature = source_signature(CITY_DATA[city])
+    signature['deltas'] = {}
+    for path in delta_files(city):
+        stat = os.stat(path)
+        signature['deltas'][os.path.basename(path)] = [stat.st_mtime, stat.st_size]
+    return signature
+
+
+def data_fingerprint(city):
+    """ Returns a hash of the data signature of a city, identifying the version of its data """
+    return hashlib.sha1(json.dumps(data_signature(city), sort_keys=True).encode()).hexdigest()
+
+
+def new_delta_files(city, old_signature, signature):
+    """
+    Returns the delta files of a city that were added since old_signature, or
+    None if the data file or an already ingested delta file changed (or was
+    removed) since then, in which case the data must be loaded from scratch.
+    """
+    if old_signature is None or 'deltas' not in old_signature:
+        return None
+    base = {k: v for k, v in signature.items() if k != 'deltas'}
+    old_base = {k: v for k, v in old_signature.items() if k != 'deltas'}
+    if base != old_base:
+        return None
+    for name, file_signature in old_signature['deltas'].items():
+        if signature['deltas'].get(name) != file_signature:
+            return None
+    return [os.path.join(DELTA_DIR, city, name) for name in signature['deltas']
+            if name not in old_signature['deltas']]
+
+
+def read_csv_files(paths):
+    """ Reads and prepares csv files in the layout of the city data files, as one DataFrame """
+    return prepare_city_data(pd.concat([pd.read_csv(path) for path in paths], ignore_index=True))
+
+
+def cache_paths(city):
+    """
+    Returns the (data file, metadata file) paths of the cached copy of a city.
+    """
+    data_file = os.path.join(CACHE_DIR, "{}.{}".format(city, cache_format()))
+    meta_file = os.path.join(CACHE_DIR, "{}.json".format(city))
+    return data_file, meta_file
+
+
+def segment_path(city, number):
+    """ Returns the path of a segment file of the cached copy of a city, see append_city_cache() """
+    return os.path.join(CACHE_DIR, "{}.segment{}.{}".format(city, number, cache_format()))
+
+
+def read_city_cache_meta(city):
+    """
+    Returns the metadata of the cached copy of a city: the signature of the data
+    it was built from, plus the numbers of its segment files under 'segments'
+    """
+    try:
+        with open(cache_paths(city)[1]) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_city_cache_signature(city):
+    """ Returns the signature of the data the cached copy of a city was built from, or None """
+    meta = read_city_cache_meta(city)
+    return None if meta is None else {k: v for k, v in meta.items() if k != 'segments'}
+
+
+def read_cache_file(path):
+    """ Reads one data file of the cache directory, in the current cache format """
+    if cache_format() == 'columns':
+        return column_store.read_column_store(path)
+    if cache_format() == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def read_city_cache(city):
+    """
+    Reads the cached copy of the city data, with the rows of its segment files.
+
+    Returns:
+        df - Pandas DataFrame with the prepared city data, or None if there is no cached copy
+    """
+    meta = read_city_cache_meta(city) or {}
+    try:
+        frames = [read_cache_file(path) for path in
+                  [cache_paths(city)[0]] + [segment_path(city, n) for n in meta.get('segments', [])]]
+    except (OSError, ValueError):
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    if COMPACT_DTYPES:
+        # Re-unify the categories of the segments
+        df = compact_frame(df)
+    return sort_by_time(df)
+
+
+def write_cache_file(path, df):
+    """ Writes a data file of the cache directory, under a temporary name first """
+    if cache_format() == 'columns':
+        # Store the end times as datetimes: as text they would be a
+        # dictionary with one entry per trip
+        column_store.write_column_store(path, df.assign(**{'End Time': end_times(df)}))
+    else:
+        tmp_file = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        if cache_format() == 'parquet':
+            df.to_parquet(tmp_file)
+        else:
+            df.to_pickle(tmp_file)
+        os.replace(tmp_file, path)
+
+
+def write_city_cache_meta(city, signature, segments):
+    """ Writes the metadata of the cached copy of a city, see read_city_cache_meta() """
+    meta_file = cache_paths(city)[1]
+    tmp_file = "{}.{}.{}.tmp".format(meta_file, os.getpid(), threading.get_ident())
+    with open(tmp_file, 'w') as f:
+        json.dump(dict(signature, segments=segments), f)
+    os.replace(tmp_file, meta_file)
+
+
+def write_city_cache(city, df, signature):
     """
-    Loads data for the specified city and filters by month and day if applicable.
+    Writes the prepared city data and the source file signature to the cache
+    directory as one file, replacing any segment files.
+    The files are written under temporary names first so readers never see partial files.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        old_segments = (read_city_cache_meta(city) or {}).get('segments', [])
+        write_cache_file(cache_paths(city)[0], df)
+        write_city_cache_meta(city, signature, [])
+        for number in old_segments:
+            try:
+                os.remove(segment_path(city, number))
+            except OSError:
+                pass
+    except Exception as e:
+        print("Some error occurred in write_city_cache(): {}".format(e))
+
+
+def append_city_cache(city, df, new_df, old_signature, signature):
+    """
+    Adds the rows of new delta files to the cached copy of a city as a segment
+    file, so only the new rows are written. The whole data is written as one
+    file instead if the cached copy is not the data the rows were added to
+    (e.g. another process refreshed it), if it has MAX_CACHE_SEGMENTS segments,
+    or in the column store format.
+
+    Args:
+        (str) city - name of the city
+        (pd.DataFrame) df - prepared city data, new rows included
+        (pd.DataFrame) new_df - prepared rows of the new delta files
+        (dict) old_signature - signature of the data before the new rows
+        (dict) signature - signature of the data with the new rows
+    """
+    meta = read_city_cache_meta(city)
+    if (meta is None or read_city_cache_signature(city) != old_signature or cache_format() == 'columns'
+            or len(meta.get('segments', [])) >= MAX_CACHE_SEGMENTS):
+        write_city_cache(city, df, signature)
+        return
+    try:
+        segments = meta.get('segments', [])
+        number = max(segments, default=0) + 1
+        write_cache_file(segment_path(city, number), new_df)
+        write_city_cache_meta(city, signature, segments + [number])
+    except Exception as e:
+        print("Some error occurred in append_city_cache(): {}".format(e))
+
+
+class FrameCache:
+    """
+    Process level LRU cache of prepared city DataFrames, bounded by memory usage.
+    Entries are keyed by city (or by selection, see STREAM_CACHE) and remember the
+    signature of the source file they were built from, so a changed csv file is
+    treated as a miss. CUBE_CACHE holds the city cubes the same way.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, city):
+        """ Returns the cached (frame, signature) of the city, even if stale, or None """
+        with self._lock:
+            entry = self._entries.get(city)
+            return None if entry is None else entry[:2]
+
+    def get(self, city, signature):
+        """ Returns the cached frame for the city, or None if missing or stale """
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry is None or entry[1] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(city)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, city, signature, df, size=None):
+        """
+        Adds a frame to the cache, evicting least recently used cities over the cap.
+        The size in bytes of other values (e.g. cubes, see CUBE_CACHE) is passed in.
+        """
+        if size is None:
+            size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if city in self._entries:
+                self.total_bytes -= self._entries.pop(city)[2]
+            self._entries[city] = (df, signature, size)
+            self.total_bytes += size
+            # Always keep the newest entry, even if it exceeds the cap by itself
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def after_fork(self):
+        """ Replaces the lock in a forked child process, where a thread that was not copied may hold it """
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """ Returns the cache counters, used to size FRAME_CACHE_MAX_MB and CUBE_CACHE_MAX_MB """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes}
+
+
+# Shared by every request served by this process
+FRAME_CACHE = FrameCache(FRAME_CACHE_MAX_MB * 2 ** 20)
+
+# Filtered frames read in streaming mode, keyed by selection instead of city
+STREAM_CACHE = FrameCache(STREAM_CACHE_MAX_MB * 2 ** 20)
+
+# Csv columns the stats (the cube and the summaries) are computed from
+STATS_COLUMNS = ['Start Time', 'Trip Duration', 'Start Station', 'End Station', 'User Type', 'Gender', 'Birth Year']
+
+# Aggregate cubes by city, with the signature of the data they were built from.
+# The trip and station rider tables grow with the number of distinct station
+# pairs, so cubes are bounded by memory usage like the frames
+CUBE_CACHE = FrameCache(CUBE_CACHE_MAX_MB * 2 ** 20)
+
+# One lock per city and kind of load ('data' or 'cube'): concurrent misses
+# (e.g. the summary and frame loads of one selection) wait for the first
+# load instead of parsing the same files again
+LOAD_LOCKS = {(city, kind): threading.Lock() for city in CITY_DATA for kind in ['data', 'cube']}
+
+# Outputs of the stats pipeline by filter selection and data fingerprint
+RESULT_CACHE = results.ResultCache(os.path.join(CACHE_DIR, 'results'), RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES)
+
+
+@metrics.timed('load_city_data', 'load')
+def load_city_data(city):
+    """
+    Loads the prepared, unfiltered data for the specified city, sorted by start time.
+    The frame is served from memory when possible; otherwise it is read from
+    the columnar cache, and the csv file is only parsed if that is out of date.
+    New delta files are parsed and appended to the cached frame without
+    reprocessing the rows ingested before.
+    The returned frame is shared and must not be modified by callers.
+
+    Args:
+        (str) city - name of the city to load
+    Returns:
+        df - Pandas DataFrame containing all the city data
+    """
+    signature = data_signature(city)
+    df = FRAME_CACHE.get(city, signature)
+    if df is not None:
+        return df
+    with LOAD_LOCKS[(city, 'data')]:
+        # Another thread may have loaded the city while this one waited
+        entry = FRAME_CACHE.peek(city)
+        if entry is not None and entry[1] == signature:
+            return entry[0]
+        return load_city_data_locked(city, signature)
+
+
+def load_city_data_locked(city, signature):
+    """ Loads the data of a city into FRAME_CACHE, see load_city_data(); called under its load lock """
+    # Start from the frame in memory, or else the cached copy, if only delta files were added since
+    entry = FRAME_CACHE.peek(city)
+    new_files = None if entry is None else new_delta_files(city, entry[1], signature)
+    if new_files is None:
+        cached_signature = read_city_cache_signature(city)
+        new_files = new_delta_files(city, cached_signature, signature)
+        entry = None if new_files is None else (read_city_cache(city), cached_signature)
+        if entry is not None and entry[0] is None:
+            new_files = None
+
+    if new_files is None:
+        df = sort_by_time(read_csv_files([CITY_DATA[city]] + delta_files(city)))
+        write_city_cache(city, df, signature)
+    elif new_files:
+        new_df = read_csv_files(new_files)
+        df = pd.concat([entry[0], new_df], ignore_index=True)
+        if COMPACT_DTYPES:
+            # Re-unify the categories of the old and new rows
+            df = compact_frame(df)
+        # New trips usually come after the ingested ones, so this rarely sorts
+        df = sort_by_time(df)
+        append_city_cache(city, df, new_df, entry[1], signature)
+    else:
+        df = entry[0]
+    if new_files != []:
+        if SHARED_COLUMNS:
+            # Serve the mapped copy, so this process shares it with the other workers too
+            mapped_df = read_city_cache(city)
+            df = df if mapped_df is None else mapped_df
+    FRAME_CACHE.put(city, signature, df)
+    return df
+
+
+def load_city_cube(city):
+    """
+    Loads the aggregate cube of the specified city (see bikeshare_cube.py).
+    The cube is built once from the city data and kept in memory and in the
+    cache directory, until the csv file changes. New delta files are added
+    to the cube by merging it with the cube of the new rows only.
+
+    Args:
+        (str) city - name of the city to load
+    Returns:
+        (dict) cube - aggregate cube of the city data
+    """
+    signature = data_signature(city)
+    city_cube = CUBE_CACHE.get(city, signature)
+    if city_cube is not None:
+        return city_cube
+    with LOAD_LOCKS[(city, 'cube')]:
+        # Another thread may have built the cube while this one waited
+        entry = CUBE_CACHE.peek(city)
+        if entry is not None and entry[1] == signature:
+            return entry[0]
+        return load_city_cube_locked(city, signature, entry)
+
+
+def load_city_cube_locked(city, signature, entry):
+    """
+    Loads the cube of a city into CUBE_CACHE, see load_city_cube(); called under
+    its load lock, with the (possibly stale) (cube, signature) entry of the city in CUBE_CACHE
+    """
+    cube_file = os.path.join(CACHE_DIR, "{}.cube.pkl".format(city))
+    new_files = None if entry is None else new_delta_files(city, entry[1], signature)
+    if new_files is None:
+        # The cube file holds (signature, cube)
+        try:
+            entry = pd.read_pickle(cube_file)[::-1]
+        except (OSError, ValueError, EOFError):
+            entry = None
+        new_files = None if entry is None else new_delta_files(city, entry[1], signature)
+
+    if new_files is None or new_files:
+        if new_files:
+            city_cube = cube.merge_cubes([entry[0], cube.build_cube(read_csv_files(new_files))])
+        elif STREAMING_INGEST:
+            city_cube = cube.merge_cubes([cube.build_cube(chunk)
+                                          for chunk in stream_chunks(city, columns=STATS_COLUMNS)])
+        else:
+            city_cube = sharded_cube(city) if SHARD_WORKERS else None
+            if city_cube is None:
+                city_cube = cube.build_cube(load_city_data(city))
+        entry = (city_cube, signature)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_file = "{}.{}.{}.tmp".format(cube_file, os.getpid(), threading.get_ident())
+            pd.to_pickle((signature, city_cube), tmp_file)
+            os.replace(tmp_file, cube_file)
+        except Exception as e:
+            print("Some error occurred in load_city_cube(): {}".format(e))
+
+    CUBE_CACHE.put(city, signature, entry[0], cube.cube_bytes(entry[0]))
+    return entry[0]
+
+
+def warm_city(city):
+    """
+    Loads the cube and the data of a city into the caches of this process unless
+    they are there already. The prefetches run it in the app process, so the
+    background jobs forked later for the city inherit both: what a job loads
+    itself is lost when it exits (its disk caches are kept, so this is quick).
+    """
+    try:
+        load_city_cube(city)
+        # Streaming mode never loads the whole city frame
+        if not STREAMING_INGEST:
+            load_city_data(city)
+    except Exception as e:
+        print("Some error occurred in warm_city(): {}".format(e))
+
+
+@metrics.timed('load_summary', 'load')
+def load_summary(city, month, weekday, date_range=None, hours=None):
+    """
+    Looks up the counts needed by the stats functions for a filter selection in the city cube.
+    Date ranges and hour windows are not covered by the cube, so those selections
+    are summarized from the filtered data instead.
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name(s) of the month(s) to filter by, or 'none' to apply no month filter
+        (str) weekday - name(s) of the day(s) of week to filter by, or 'none'to apply no day filter
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (tuple) hours - first and last hour of the day (0 to 23), or None
+    Returns:
+        (dict) summary - counts of each stats column, see bikeshare_cube.query_cube()
+    """
+    try:
+        if date_range is not None or hours is not None:
+            if SHARD_WORKERS and not STREAMING_INGEST:
+                partials = map_city_shards(city, shard_summary, month, weekday, hours,
+                                           date_range=date_range, month=month)
+                if partials is not None:
+                    return cube.merge_summaries(partials)
+            return cube.summarize(load_data(city, month, weekday, date_range, hours, columns=STATS_COLUMNS))
+        return cube.query_cube(load_city_cube(city), month, weekday)
+    except Exception as e:
+        print("Some error occurred in load_summary(): {}".format(e))
+
+
+# Process pool of the sharded mode, started on first use
+SHARD_POOL = None
+SHARD_POOL_LOCK = threading.Lock()
+
+
+def shard_pool():
+    """ Returns the process pool of the sharded mode, starting it on first use """
+    global SHARD_POOL
+    with SHARD_POOL_LOCK:
+        if SHARD_POOL is None:
+            SHARD_POOL = ProcessPoolExecutor(max_workers=SHARD_WORKERS)
+        return SHARD_POOL
+
+
+def shard_summary(df, month, weekday, hours):
+    """ Runs in a shard worker: summarizes the rows of a shard matching the filters """
+    return cube.summarize(filter_frame(df, month, weekday, hours=hours))
+
+
+def map_city_shards(city, func, *args, date_range=None, month='none'):
+    """
+    Computes partial aggregates of the shards of the city data in the shard pool
+    (see bikeshare_shards.py). Only the rows within the date range are sharded,
+    and with SHARD_BY = 'month' only the months selected by the month filter.
+
+    Args:
+        (str) city - name of the city
+        (function) func - called as func(rows of a shard, *args) in a worker process
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (str) month - name(s) of the month(s) to filter by, or 'none'
+    Returns:
+        (list) partials - the result of each shard, or None if the column store
+                          file of the city is not up to date (the caller then
+                          computes the aggregates in this process)
+    """
+    df = load_city_data(city)
+    if read_city_cache_signature(city) != data_signature(city):
+        return None
+
+    first_row, last_row = (0, len(df)) if date_range is None else time_slice_rows(df, date_range)
+    if SHARD_BY == 'month':
+        months = df['Month'].cat.categories
+        selected = filter_values(month)
+        selected_codes = None if selected is None else set(months.get_indexer(selected))
+        month_codes = df['Month'].cat.codes.values[first_row:last_row]
+        shards = [(start, stop) for start, stop, code in sharding.month_shards(month_codes, first_row)
+                  if selected_codes is None or code in selected_codes]
+    else:
+        shards = sharding.row_shards(first_row, last_row, SHARD_WORKERS * SHARDS_PER_WORKER)
+    if not shards:
+        # Nothing to aggregate: the aggregates of no rows
+        return [func(df.iloc[0:0], *args)]
+    return sharding.map_shards(shard_pool(), cache_paths(city)[0], shards, func, *args)
+
+
+def sharded_cube(city):
+    """ Builds the cube of a city from the cubes of its shards, or returns None, see map_city_shards() """
+    partials = map_city_shards(city, cube.build_cube)
+    return None if partials is None else cube.merge_cubes(partials)
+
+
+def stream_chunks(city, month='none', weekday='none', columns=None, chunksize=None, date_range=None, hours=None,
+                  paths=None):
+    """
+    Reads the csv file (and delta files) of a city in chunks and yields the
+    prepared rows of each chunk that match the filters.
+
+    Args:
+        (str) city - name of the city to read
+        (str) month - name(s) of the month(s) to filter by, or 'none' to apply no month filter
+        (str) weekday - name(s) of the day(s) of week to filter by, or 'none'to apply no day filter
+        (list) columns - csv columns to parse ('Start Time' is always parsed; columns
+                         missing from the file are skipped), or None for all
+        (int) chunksize - number of rows per chunk, defaults to CHUNK_SIZE
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (tuple) hours - first and last hour of the day (0 to 23), or None
+        (list) paths - csv files to read instead of the files of the city, or None
+    Returns:
+        (generator) chunks - prepared DataFrames of the matching rows of each chunk
+    """
+    usecols = None
+    if columns is not None:
+        wanted = set(columns) | {'Start Time'}
+        # A callable, as a list of names fails on a file without one of them (e.g. washington has no 'Gender')
+        usecols = lambda column: column in wanted
+    for path in paths or [CITY_DATA[city]] + delta_files(city):
+        yield from filter_chunks(pd.read_csv(path, usecols=usecols, chunksize=chunksize or CHUNK_SIZE),
+                                 month, weekday, date_range, hours)
+
+
+def filter_chunks(reader, month, weekday, date_range=None, hours=None):
+    """ Yields the prepared rows of each chunk of a csv reader that match the filters """
+    for chunk in reader:
+        # Filter on the parsed start time before preparing the other columns
+        start_time = parse_timestamps(chunk['Start Time'])
+        mask = np.ones(len(chunk), dtype=bool)
+        if filter_values(month) is not None:
+            mask &= np.isin(start_time.dt.month, [MONTH_NAMES.index(m) + 1 for m in filter_values(month)])
+        if filter_values(weekday) is not None:
+            mask &= np.isin(start_time.dt.dayofweek, [WEEKDAY_NAMES.index(d) for d in filter_values(weekday)])
+        if date_range is not None:
+            first, last = date_bounds(date_range)
+            if first is not None:
+                mask &= (start_time >= first).values
+            if last is not None:
+                mask &= (start_time < last).values
+        if hours is not None:
+            mask &= hour_mask(start_time.dt.hour.values, hours)
+        chunk = chunk[mask].copy()
+        chunk['Start Time'] = start_time[mask]
+        yield prepare_city_data(chunk, compact=False)
+
+
+@metrics.timed('stream_data', 'load')
+def stream_data(city, month, weekday, columns=None, chunksize=None, date_range=None, hours=None):
+    """
+    Loads data for the specified city filtered by month and day, reading the
+    csv file in chunks so that only the matching rows are ever kept in memory.
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name(s) of the month(s) to filter by, or 'none' to apply no month filter
+        (str) weekday - name(s) of the day(s) of week to filter by, or 'none'to apply no day filter
+        (list) columns - csv columns to parse ('Start Time' is always parsed), or None for all
+        (int) chunksize - number of rows per chunk, defaults to CHUNK_SIZE
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (tuple) hours - first and last hour of the day (0 to 23), or None
+    Returns:
+        df - Pandas DataFrame containing city data filtered by month and day
+    """
+    chunks = list(stream_chunks(city, month, weekday, columns, chunksize, date_range, hours))
+    df = pd.concat(chunks, ignore_index=True)
+    if COMPACT_DTYPES:
+        df = compact_frame(df)
+    return df
+
+
+def load_stream(city, month, weekday, columns=None, date_range=None, hours=None):
+    """
+    Returns stream_data() of a selection, kept in STREAM_CACHE until the data of
+    the city changes. A cached frame with all the columns also serves a selection
+    of fewer columns.
+    """
+    signature = data_signature(city)
+    selection = [city, filter_values(month), filter_values(weekday),
+                 None if date_range is None else list(date_range),
+                 None if hours is None else list(hours)]
+    for key_columns in [None] if columns is None else [None, sorted(columns)]:
+        df = STREAM_CACHE.get(json.dumps(selection + [key_columns]), signature)
+        if df is not None:
+            return df
+    df = stream_data(city, month, weekday, columns=columns, date_range=date_range, hours=hours)
+    STREAM_CACHE.put(json.dumps(selection + [None if columns is None else sorted(columns)]), signature, df)
+    return df
+
+
+def stream_top_routes(city, month, weekday, k=TOP_ROUTES, method='space-saving', paths=None):
+    """
+    Finds the most popular trips of a city in one pass over its csv files in
+    chunks, in bounded memory, for data too large for the exact station pair
+    counts of the cube. Station pairs are counted as int64 keys made from
+    station codes that stay the same across chunks.
 
     Args:
         (str) city - name of the city to analyze
         (str) month - name of the month to filter by, or 'none' to apply no month filter
         (str) weekday - name of the day of week to filter by, or 'none'to apply no day filter
+        (int) k - number of trips to list
+        (str) method - 'space-saving' (counts never overestimated, error at most
+                       rows / (HEAVY_HITTER_COUNTERS + 1)) or 'count-min' (counts never
+                       underestimated, error at most COUNT_MIN_EPSILON * rows with
+                       probability 1 - COUNT_MIN_DELTA)
+        (list) paths - csv files to read instead of the files of the city, or None
+    Returns:
+        (dict) table - the trips with the lower and upper bounds of their counts, as a stats_table()
+    """
+    if method == 'space-saving':
+        summary = sketch.SpaceSaving(HEAVY_HITTER_COUNTERS)
+    else:
+        summary = sketch.CountMinSketch(COUNT_MIN_EPSILON, COUNT_MIN_DELTA, HEAVY_HITTER_COUNTERS)
+    stations = sketch.Vocabulary()
+    for chunk in stream_chunks(city, month, weekday, columns=cube.TRIP_DIMS, paths=paths):
+        start_codes = stations.encode(chunk['Start Station'].values)
+        end_codes = stations.encode(chunk['End Station'].values)
+        summary.update(sketch.pair_keys(start_codes, end_codes))
+
+    keys, lower, upper = summary.top(k)
+    start_codes, end_codes = sketch.split_pair_keys(keys)
+    rows = [[rank, stations.values[start], stations.values[end], low, high]
+            for rank, (start, end, low, high) in enumerate(zip(start_codes, end_codes, lower, upper), start=1)]
+    return stats_table(['Rank', 'Start Station', 'End Station', 'Count (lower bound)', 'Count (upper bound)'], rows)
+
+
+def filter_values(value):
+    """
+    Returns the names selected by a month or weekday filter in title case: the
+    filter is a name, a list of names, or 'none' (returns None, no filter)
+    """
+    if isinstance(value, str):
+        return None if value == 'none' else [value.title()]
+    return [v.title() for v in value] if value else None
+
+
+def date_bounds(date_range):
+    """
+    Returns the [first, last) Timestamps of a range of dates; the last date is
+    included, and a missing first or last date (None) leaves that end open
+    """
+    first, last = date_range
+    first = None if first is None else pd.Timestamp(first).normalize()
+    last = None if last is None else pd.Timestamp(last).normalize() + pd.Timedelta(days=1)
+    return first, last
+
+
+def time_slice_rows(df, date_range):
+    """
+    Returns the [first_row, last_row) range of the rows of data sorted by
+    'Start Time' within a range of dates, found by binary search
+    """
+    first, last = date_bounds(date_range)
+    start_times = df['Start Time'].values
+    first_row = 0 if first is None else int(np.searchsorted(start_times, np.datetime64(first, 'ns')))
+    last_row = len(df) if last is None else int(np.searchsorted(start_times, np.datetime64(last, 'ns')))
+    return first_row, last_row
+
+
+def time_slice(df, date_range):
+    """
+    Returns the rows of data sorted by 'Start Time' within a range of dates, found
+    by binary search, as a slice (a view: no rows are copied or scanned)
+    """
+    first_row, last_row = time_slice_rows(df, date_range)
+    return df.iloc[first_row:last_row]
+
+
+def code_mask(column, values):
+    """
+    Returns the mask of the rows of a categorical column holding one of the
+    values, by looking the category codes up in a small table of selected codes
+    """
+    selected = np.zeros(len(column.cat.categories) + 1, dtype=bool)
+    selected[column.cat.categories.get_indexer(values)] = True
+    # Missing values have code -1, the last (unselected) entry of the table
+    selected[-1] = False
+    return selected[column.cat.codes.values]
+
+
+def hour_mask(hours, hour_range):
+    """ Returns the mask of the hours (0 to 23) within a window of hours, first and last included """
+    selected = np.zeros(24, dtype=bool)
+    selected[hour_range[0]:hour_range[1] + 1] = True
+    return selected[hours]
+
+
+def filter_frame(df, month, weekday, date_range=None, hours=None):
+    """
+    Filters prepared city data sorted by start time. The date range is cut out
+    as a slice first, so the other filters only scan the rows within the range.
+    Returns the shared frame itself when nothing is filtered out.
+    """
+    if date_range is not None:
+        df = time_slice(df, date_range)
+
+    # Combine the masks so the shared city frame is only copied once
+    mask = None
+    for column, values in [('Month', filter_values(month)), ('Weekday', filter_values(weekday))]:
+        if values is not None:
+            column_mask = code_mask(df[column], values)
+            mask = column_mask if mask is None else mask & column_mask
+    if hours is not None:
+        column_mask = hour_mask(df['Hour'].values, hours)
+        mask = column_mask if mask is None else mask & column_mask
+
+    if mask is None or mask.all():
+        return df
+    return df[mask]
+
+
+@metrics.timed('load_data', 'load')
+def load_data(city, month, weekday, date_range=None, hours=None, columns=None):
+    """
+    Loads data for the specified city and filters it if applicable.
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name(s) of the month(s) to filter by, or 'none' to apply no month filter
+        (str) weekday - name(s) of the day(s) of week to filter by, or 'none'to apply no day filter
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (tuple) hours - first and last hour of the day (0 to 23), or None
+        (list) columns - csv columns needed by the caller, or None for all; in
+                         streaming mode only these are parsed, otherwise all are returned
     Returns:
         df - Pandas DataFrame containing city data filtered by month and day
     """
     try:
-        # Load city data into DataFrame
-        df = pd.read_csv(CITY_DATA[city])
-
-        # Convert start and end times to datetime
-        df['Start Time'] = pd.to_datetime(df['Start Time'])
-        df['End Time'] = pd.to_datetime(df['End Time'])
-
-        # Create three new columns, 'Month', 'Weekday' and 'Hour'
-        # based one the 'Start Time' column
-        df['Month'] = df['Start Time'].dt.month_name()
-        df['Weekday'] = df['Start Time'].dt.day_name()
-        df['Hour'] = df['Start Time'].dt.hour
-
-        # Filter data depending on filter choices
-        # Filter by month
-        if month != 'none':
-            df = df[df['Month'] == month.title()]
-
-        # Filter by weekday
-        if weekday != 'none':
-            df = df[df['Weekday'] == weekday.title()]
-        return df
+        # Read only the matching rows in streaming mode, unless the whole city
+        # frame is cached in memory already
+        filtered = (month != 'none' or weekday != 'none' or date_range is not None or hours is not None)
+        if STREAMING_INGEST and filtered:
+            if FRAME_CACHE.get(city, data_signature(city)) is None:
+                return load_stream(city, month, weekday, columns, date_range, hours)
+
+        # Load city data into DataFrame, cut to the date range by binary search
+        df = load_city_data(city)
+        if date_range is not None:
+            df = time_slice(df, date_range)
+        metrics.count_rows('load_data', len(df))
+        return filter_frame(df, month, weekday, hours=hours)
     except Exception as e:
         print("Some error occurred in load_data(): {}".format(e))
 # #############################################################################
@@ -83,58 +1042,236 @@ Args:
 Returns:
     (dbc.table) table - dash_bbotstrap_components table
 """
+@metrics.timed('create_dbc_table', 'render')
 def create_dbc_table(rows, column_names):
-    rdf = pd.DataFrame(rows, columns=column_names)
-    # Create data table
-    table = dbc.Table.from_dataframe(rdf,
-                                     dark=True,
-                                     striped=True,
-                                     bordered=True,
-                                     hover=True,
-                                     style={'color': 'white'})
+    # Build the table components directly from the rows (like dbc.Table.from_dataframe,
+    # without the intermediate DataFrame)
+    header = html.Thead(html.Tr([html.Th(name) for name in column_names]))
+    body = html.Tbody([html.Tr([html.Td(value) for value in row]) for row in rows])
+    table = dbc.Table([header, body],
+                      dark=True,
+                      striped=True,
+                      bordered=True,
+                      hover=True,
+                      style={'color': 'white'})
     return table
 # #############################################################################
 
 
 
+# STATS DATA
+# The *_stats_data functions return plain Python data (tables of rows) that
+# can be written as JSON or csv; the *_stats functions render them for the app
+def plain(value):
+    """ Converts NumPy scalars to Python values, so the stats data can be written as JSON """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def stats_table(column_names, rows):
+    """
+    Returns a table of stats as plain data
+    Args:
+        (list) column_names - list of column names
+        (list) rows - list of rows
+    Returns:
+        (dict) table - {'columns': column names, 'rows': rows of Python values}
+    """
+    return {'columns': list(column_names),
+            'rows': [[plain(value) for value in row] for row in rows]}
+
+
+def time_stats_data(summary):
+    """
+    Computes the most common month, weekday and start hour
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) table - the statistics as a stats_table()
+    """
+    rows = []
+    for metric, column in [('Most common month', 'Month'),
+                           ('Most common weekday', 'Weekday'),
+                           ('Most common hour', 'Hour')]:
+        value, count = cube.top_value(summary[column])
+        rows.append([metric, value, count])
+    return stats_table(['Metric', 'Result', 'Count'], rows)
+
+
+def station_stats_data(summary):
+    """
+    Computes the most popular start station, end station and trip
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) table - the statistics as a stats_table()
+    """
+    most_common_start, start_count = cube.top_value(summary['Start Station'])
+    most_common_end, end_count = cube.top_value(summary['End Station'])
+    (most_popular_start, most_popular_end), start_end_count = cube.top_value(summary['Trip'])
+    rows = [['Most popular Start Station', most_common_start, start_count],
+            ['Most popular End Station', most_common_end, end_count],
+            ['Most popular Start & End Station Combo',
+             most_popular_start + " AND " + most_popular_end,
+             start_end_count]]
+    return stats_table(['Metric', 'Result', 'Count'], rows)
+
+
+def top_routes_data(summary, k=TOP_ROUTES):
+    """
+    Lists the k most popular trips, counted exactly from the integer station pair codes
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+        (int) k - number of trips to list
+    Returns:
+        (dict) table - the trips as a stats_table()
+    """
+    top_trips = cube.top_values(summary['Trip'], k)
+    rows = [[rank, start, end, count]
+            for rank, ((start, end), count) in enumerate(top_trips.items(), start=1)]
+    return stats_table(['Rank', 'Start Station', 'End Station', 'Count'], rows)
+
+
+def trip_duration_stats_data(summary):
+    """
+    Computes the total and average trip duration, and its percentiles from the
+    merged duration sketches (within cube.DURATION_ACCURACY of the exact values)
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) table - the statistics as a stats_table(), in seconds
+    """
+    total_trip_time = summary['Trip Duration']['sum']
+    avg_trip_time = total_trip_time / summary['Trip Duration']['count']
+    rows = [['Total Trip Time', total_trip_time],
+            ['Average Trip Time', avg_trip_time]]
+    percentiles = sketch.log_bucket_quantiles(summary['Duration Bucket'], DURATION_PERCENTILES,
+                                              cube.DURATION_ACCURACY)
+    for percentile, seconds in zip(DURATION_PERCENTILES, percentiles):
+        rows.append(["{}th Percentile Trip Time".format(round(percentile * 100)), round(seconds)])
+    return stats_table(['Metric', 'Seconds'], rows)
+
+
+def trip_duration_histogram_data(summary):
+    """
+    Computes the number and percentage of trips in each bin of the duration histogram
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) table - the histogram as a stats_table()
+    """
+    counts = summary['Duration Bin'].reindex(range(len(cube.DURATION_BIN_LABELS)), fill_value=0)
+    percent = (counts / counts.sum() * 100).round(2)
+    rows = [[label, count, pct] for label, count, pct in zip(cube.DURATION_BIN_LABELS, counts, percent)]
+    return stats_table(['Duration', 'Trips', 'Percent'], rows)
+
+
+def user_stats_data(summary):
+    """
+    Computes the user type and gender counts and the birth year statistics
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) tables - 'user_types', 'genders' and 'birth_years' stats_table()s;
+                        the last two are None if the data has no gender/birth year
+    """
+    tables = {'genders': None, 'birth_years': None}
+
+    user_type_stats = cube.describe_counts(summary['User Type'])
+    tables['user_types'] = stats_table(['User Type', 'Count', '% of Total'],
+                                       zip(user_type_stats['counts'].index,
+                                           user_type_stats['counts'].values,
+                                           user_type_stats['percent'].values))
+
+    if 'Gender' in summary:
+        gender_stats = cube.describe_counts(summary['Gender'])
+        tables['genders'] = stats_table(['Gender Type', 'Count', '% of Total'],
+                                        zip(gender_stats['counts'].index,
+                                            gender_stats['counts'].values,
+                                            gender_stats['percent'].values))
+
+    if 'Birth Year' in summary:
+        birth_year_counts = summary['Birth Year']
+        oldest_year = int(birth_year_counts.index.min())
+        youngest_year = int(birth_year_counts.index.max())
+        most_common_year = int(cube.top_value(birth_year_counts)[0])
+        tables['birth_years'] = stats_table(['Birth Year of oldest rider',
+                                             'Birth Year of youngest rider',
+                                             'Most common Birth Year'],
+                                            [[oldest_year, youngest_year, most_common_year]])
+    return tables
+
+
+def station_riders_data(summary):
+    """
+    Computes the trips from each start station counted by user type, by gender
+    and by decade of birth, each on its own, from the station riders counts of the cube
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) table - one row per start station, by decreasing trips, as a stats_table();
+                       the gender and birth decade columns are left out if the data has none
+    """
+    riders = summary['Station Riders']
+    tables = [cube.count_matrix(riders, 'Start Station').rename(columns={'Count': 'Trips'})]
+    for column in cube.STATION_RIDER_DIMS[1:]:
+        if column in riders.index.names:
+            tables.append(cube.count_matrix(riders, 'Start Station', column))
+    if 'Birth Decade' in riders.index.names:
+        tables[-1] = tables[-1].rename(columns=lambda decade: "{}s".format(int(decade)))
+    table = pd.concat(tables, axis=1).fillna(0).astype(np.int64)
+    table = table.sort_index().sort_values('Trips', ascending=False, kind='stable')
+    return stats_table(['Start Station'] + [str(column) for column in table.columns],
+                       [[station] + row for station, row in zip(table.index, table.values.tolist())])
+
+
+def all_stats_data(summary):
+    """
+    Computes all the statistics of the stats tabs as plain data
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (dict) stats - {'rows': number of trips, 'time', 'station', 'routes', 'trip', 'durations' tables,
+                        the 'user_types', 'genders' and 'birth_years' tables, and 'station_riders'};
+                        only 'rows' if no trips match the filters
+    """
+    if summary['rows'] == 0:
+        return {'rows': 0}
+    stats = {'rows': summary['rows'],
+             'time': time_stats_data(summary),
+             'station': station_stats_data(summary),
+             'routes': top_routes_data(summary),
+             'trip': trip_duration_stats_data(summary),
+             'durations': trip_duration_histogram_data(summary),
+             'station_riders': station_riders_data(summary)}
+    stats.update(user_stats_data(summary))
+    return stats
+# #############################################################################
+
+
+
 # TIME STATS
-def time_stats(df):
+@metrics.timed('time_stats', 'compute')
+def time_stats(summary):
     """
     Computes the time based statistics for the Time Tab display
     Args:
-        (pd.DataFrame) df - dataframe used for the computations
+        (dict) summary - counts of the filtered data, see load_summary()
     Returns:
         (list) output_list - output list containing return values for
                             application layout components
     """
+    if summary['rows'] == 0:
+        return ["Popular Times of Travel:", NO_TRIPS_TEXT, ""]
     output_list = []
-    column_names = ['Metric', 'Result', 'Count']
-    rdf_rows = []
 
     start_time = time.time()
-    # display the most common month
-    most_common_month = df['Month'].mode()[0]
-    month_count = df['Month'].value_counts().values[0]
-    data_row = ['Most common month', most_common_month, month_count]
-    rdf_rows.append(data_row)
-
-    # display the most common day of week
-    most_common_weekday = df['Weekday'].value_counts().index[0]
-    day_count = df['Weekday'].value_counts().values[0]
-    data_row = ['Most common weekday', most_common_weekday, day_count]
-    rdf_rows.append(data_row)
-
-    # display the most common start hour
-    most_common_hour = df['Hour'].value_counts().index[0]
-    hour_count = df['Hour'].value_counts().values[0]
-    data_row = ['Most common hour', most_common_hour, hour_count]
-    rdf_rows.append(data_row)
+    table_data = time_stats_data(summary)
 
     # execution time
     time_taken = "This computation took {} seconds.".format(round((time.time() - start_time), 4))
 
     # Create a result data frame and add it to the output list
-    time_table = create_dbc_table(rdf_rows, column_names)
+    time_table = create_dbc_table(table_data['rows'], table_data['columns'])
     output_list.append("Popular Times of Travel:")
     output_list.append(time_table)
     output_list.append(time_taken)
@@ -144,92 +1281,92 @@ def time_stats(df):
 
 
 # STATION STATS
-def station_stats(df):
+@metrics.timed('station_stats', 'compute')
+def station_stats(summary):
     """
     Computes statistics on the most popular stations and trips
     Args:
-        (pd.DataFrame) df - dataframe used for the computations
+        (dict) summary - counts of the filtered data, see load_summary()
     Returns:
         (list) output_list - output list containing return values for
                             application layout components
     """
+    if summary['rows'] == 0:
+        return ["Popular Stations and Trips: ", NO_TRIPS_TEXT, ""]
     output_list = []
-    column_names = ['Metric', 'Result', 'Count']
-    rdf_rows = []
 
     start_time = time.time()
-    # Most popular start station
-    most_common_start = df['Start Station'].value_counts().index[0]
-    start_count = df['Start Station'].value_counts().values[0]
-    data_row = ['Most popular Start Station', most_common_start, start_count]
-    rdf_rows.append(data_row)
-
-    # display most popular end station
-    most_common_end = df['End Station'].value_counts().index[0]
-    end_count = df['End Station'].value_counts().values[0]
-    data_row = ['Most popular End Station', most_common_end, end_count]
-    rdf_rows.append(data_row)
-
-    # display most frequent combination of start station and end station trip
-    most_popular_trip = df.groupby(['Start Station', 'End Station']).size().nlargest(1)
-    most_popular_start = most_popular_trip.index[0][0]
-    most_popular_end = most_popular_trip.index[0][1]
-    start_end_count = most_popular_trip[0]
+    table_data = station_stats_data(summary)
+    routes_data = top_routes_data(summary)
 
     # execution time
     time_taken = "This computation took {} seconds.".format(round((time.time() - start_time), 4))
 
-    data_row = ['Most popular Start & End Station Combo',
-                most_popular_start + " AND " + most_popular_end,
-                start_end_count]
-    # Create data table
-    rdf_rows.append(data_row)
-    station_table = create_dbc_table(rdf_rows, column_names)
+    # Create data tables
+    station_table = create_dbc_table(table_data['rows'], table_data['columns'])
+    routes_table = create_dbc_table(routes_data['rows'], routes_data['columns'])
 
     output_list.append("Popular Stations and Trips: ")
-    output_list.append(station_table)
+    output_list.append([station_table, routes_table])
     output_list.append(time_taken)
     return output_list
 # #############################################################################
 
 
 # TRIP DURATION STATS
-def trip_duration_stats(df):
+# Template of the duration histogram, as figure JSON like the user type pie chart
+HISTOGRAM_TRACE = {'type': 'bar',
+                   'hovertemplate': "duration=%{x}<br>trips=%{y}<extra></extra>",
+                   'marker': {'color': 'mediumturquoise', 'line': {'color': '#000000', 'width': 1}}}
+HISTOGRAM_LAYOUT = {'title': {'text': "Trip durations: ", 'font': {'size': 20}, 'x': 0.5},
+                    'font': {'color': '#2a3f5f'},
+                    'xaxis': {'title': {'text': "duration"}},
+                    'yaxis': {'title': {'text': "trips"}},
+                    'margin': {'l': 60, 'r': 20, 't': 40, 'b': 40},
+                    'paper_bgcolor': 'LightSteelBlue',
+                    'height': 300,
+                    'width': 700}
+
+
+@metrics.timed('trip_duration_stats', 'compute')
+def trip_duration_stats(summary):
     """
-    Computes statistics on the total and average trip duration.
+    Computes statistics on the total, average and percentile trip durations,
+    and the histogram of the durations.
     Args:
-        (pd.DataFrame) df - dataframe used for the computations
+        (dict) summary - counts of the filtered data, see load_summary()
     Returns:
         (list) output_list - output list containing return values for
                             application layout components
     """
+    if summary['rows'] == 0:
+        return ["Trip Durations: ", NO_TRIPS_TEXT, {}, ""]
     output_list = []
     column_names = ['Metric', 'Result']
-    rdf_rows = []
 
     start_time = time.time()
-    # display total travel time
-    total_trip_time = df['Trip Duration'].sum()
-    data_row = ['Total Trip Time',
-                str(pd.to_timedelta(total_trip_time, unit='s'))
-                ]
-    rdf_rows.append(data_row)
-
-    # display mean travel time
-    avg_trip_time = df['Trip Duration'].mean()
-    data_row = ['Average Trip Time',
-                str(pd.to_timedelta(avg_trip_time, unit='s'))
-                ]
-    rdf_rows.append(data_row)
+    table_data = trip_duration_stats_data(summary)
+    histogram_data = trip_duration_histogram_data(summary)
 
     # execution time
     time_taken = "This computation took {} seconds.".format(round((time.time() - start_time), 4))
 
+    # Display the durations as timedeltas
+    rdf_rows = [[metric, str(pd.to_timedelta(seconds, unit='s'))]
+                for metric, seconds in table_data['rows']]
+
     # Create data table
     trip_table = create_dbc_table(rdf_rows, column_names)
 
+    # Histogram of the durations, from the prebuilt template
+    histogram = {'data': [dict(HISTOGRAM_TRACE,
+                               x=[row[0] for row in histogram_data['rows']],
+                               y=[row[1] for row in histogram_data['rows']])],
+                 'layout': HISTOGRAM_LAYOUT}
+
     output_list.append("Trip Durations: ")
     output_list.append(trip_table)
+    output_list.append(histogram)
     output_list.append(time_taken)
     return output_list
 # #############################################################################
@@ -238,74 +1375,72 @@ def trip_duration_stats(df):
 
 
 # USER STATS
-def user_stats(df):
+# Template of the user type pie chart, as figure JSON: only the labels and
+# values change per call. It looks like the plotly.express pie with the
+# default template, without sending that template with every figure
+PIE_TRACE = {'type': 'pie',
+             'hovertemplate': "user type=%{label}<br>count=%{value}<extra></extra>",
+             'textposition': 'inside',
+             'textinfo': 'percent+label',
+             'marker': {'colors': ['gold', 'mediumturquoise', 'darkorange', 'lightgreen'],
+                        'line': {'color': '#000000', 'width': 2}}}
+PIE_LAYOUT = {'title': {'text': "Percentage of user types: ", 'font': {'size': 20}, 'x': 0.5},
+              'font': {'color': '#2a3f5f'},
+              'margin': {'l': 20, 'r': 20, 't': 40, 'b': 10},
+              'paper_bgcolor': 'LightSteelBlue',
+              'height': 300,
+              'width': 700}
+
+
+@metrics.timed('user_stats', 'compute')
+def user_stats(summary, city):
     """
     Computes statistics on on bikeshare users.
     Args:
-        (pd.DataFrame) df - dataframe used for the computations
+        (dict) summary - counts of the filtered data, see load_summary()
+        (str) city - name of the city, used in the messages for missing gender/birth year data
     Returns:
         (list) output_list - output list containing return values for
                             application layout components
     """
+    if summary['rows'] == 0:
+        return [NO_TRIPS_TEXT, {}, "", "", ""]
     user_stat_list = []
     start_time = time.time()
+    tables = user_stats_data(summary)
 
     # Display counts of user types
-    column_names = ['User Type', 'Count', '% of Total']
-    user_types = df['User Type'].value_counts().index
-    user_counts = df['User Type'].value_counts().values
-    user_count_percentage = np.round((df['User Type'].value_counts(normalize=True) * 100).values, 2)
-    rdf_rows = list(zip(user_types, user_counts, user_count_percentage))
-    user_type_table = create_dbc_table(rdf_rows, column_names)
+    user_types = tables['user_types']
+    user_type_table = create_dbc_table(user_types['rows'], user_types['columns'])
     user_stat_list.append(user_type_table)
 
-    # Create a pie chart for user type
-    pie_names = df['User Type'].unique()
-    pie_data = list(zip(user_counts, pie_names))
-    pie_df = pd.DataFrame(data=pie_data, columns=['count', 'user type'])
-    pie_chart = px.pie(pie_df, values='count', names='user type', title="Percentage of user types: ")
-    colors = ['gold', 'mediumturquoise', 'darkorange', 'lightgreen']
-    pie_chart.update_layout(margin=dict(l=20, r=20, t=40, b=10),
-                            paper_bgcolor= 'LightSteelBlue',
-                            height=300,
-                            width=700,
-                            title_x=0.5,
-                            title_font_size=20)
-    pie_chart.update_traces(textposition='inside', textinfo='percent+label',
-                            marker = dict(colors=colors, line=dict(color='#000000', width=2)))
+    # Create a pie chart for user type from the prebuilt template
+    pie_chart = {'data': [dict(PIE_TRACE,
+                               labels=[row[0] for row in user_types['rows']],
+                               values=[row[1] for row in user_types['rows']])],
+                 'layout': PIE_LAYOUT}
 
     user_stat_list.append(pie_chart)
 # #############################################################################
 
 
 
-    # Display counts of gender only if city is Washington
-    if CITY == 'washington':
-        gender_na_text = "Gender data is not available for {} right now!".format(CITY.capitalize())
-        birth_na_text = "Birth Year data is not available for {} right now!".format(CITY.capitalize())
+    # Display counts of gender only if the city data has them (not for Washington)
+    if tables['genders'] is None:
+        gender_na_text = "Gender data is not available for {} right now!".format(city.capitalize())
         user_stat_list.append(gender_na_text)
-        user_stat_list.append(birth_na_text)
-
     else:
-        column_names = ['Gender Type', 'Count', '% of Total']
-        gender_types = df['Gender'].value_counts().index
-        gender_counts = df['Gender'].value_counts().values
-        gender_count_percentage = np.round((df['Gender'].value_counts(normalize=True) * 100).values, 2)
-        rdf_rows = list(zip(gender_types, gender_counts, gender_count_percentage))
-        user_gender_table = create_dbc_table(rdf_rows, column_names)
+        genders = tables['genders']
+        user_gender_table = create_dbc_table(genders['rows'], genders['columns'])
         user_stat_list.append(user_gender_table)
 
-        # Display earliest, most recent, and most common year of birth
-        column_names = ['Birth Year of oldest rider',
-                        'Birth Year of youngest rider',
-                        'Most common Birth Year']
-        rdf_rows = []
-        oldest_year = int(df['Birth Year'].min())
-        youngest_year = int(df['Birth Year'].max())
-        most_common_year = int(df['Birth Year'].mode()[0])
-        rdf_rows.append([oldest_year, youngest_year, most_common_year])
-
-        user_age_table = create_dbc_table(rdf_rows, column_names)
+    # Display earliest, most recent, and most common year of birth
+    if tables['birth_years'] is None:
+        birth_na_text = "Birth Year data is not available for {} right now!".format(city.capitalize())
+        user_stat_list.append(birth_na_text)
+    else:
+        birth_years = tables['birth_years']
+        user_age_table = create_dbc_table(birth_years['rows'], birth_years['columns'])
         user_stat_list.append(user_age_table)
 
     # execution time
@@ -316,41 +1451,292 @@ def user_stats(df):
 # #############################################################################
 
 
+# STATION RIDERS
+@metrics.timed('station_riders_stats', 'compute')
+def station_riders_stats(summary):
+    """
+    Computes the riders of every start station for the Station Riders Tab display.
+    The whole table is sent at once and sorted and paged in the browser, so
+    sorting it by any column needs no request to the server.
+    Args:
+        (dict) summary - counts of the filtered data, see load_summary()
+    Returns:
+        (list) output_list - output list containing return values for
+                            application layout components
+    """
+    if summary['rows'] == 0:
+        return [NO_TRIPS_TEXT, [], [], 0, ""]
+    output_list = []
+    start_time = time.time()
+    table_data = station_riders_data(summary)
+
+    # execution time
+    time_taken = "This computation took {} seconds.".format(round((time.time() - start_time), 4))
+
+    # Every column but the station name holds counts, sorted as numbers
+    columns = [{'name': name, 'id': name, 'type': 'text' if name == 'Start Station' else 'numeric'}
+               for name in table_data['columns']]
+    rows = [dict(zip(table_data['columns'], row)) for row in table_data['rows']]
+
+    # The table joins one station x dimension table per dimension, so its columns are
+    # the values of the dimensions ('Subscriber', 'Male', '1980s'), each counted on its
+    # own rather than in combination; the dimensions are read from the index levels
+    dimensions = ["user type"]
+    if 'Gender' in summary['Station Riders'].index.names:
+        dimensions.append("gender")
+    if 'Birth Decade' in summary['Station Riders'].index.names:
+        dimensions.append("decade of birth")
+    if len(dimensions) == 1:
+        breakdown = "by " + dimensions[0]
+    else:
+        breakdown = "{} and by {}, each on its own".format(
+            ", ".join("by " + dimension for dimension in dimensions[:-1]), dimensions[-1])
+    output_list.append("Trips from {} start stations, counted {}: ".format(len(rows), breakdown))
+    output_list.append(columns)
+    output_list.append(rows)
+    output_list.append(0)
+    output_list.append(time_taken)
+    return output_list
+# #############################################################################
+
+
 # RAW DATA
-def display_raw_data(df):
+@metrics.timed('display_raw_data', 'render')
+def display_raw_data(df, page):
     """
-    Computes raw data 5 rows at a time
+    Computes one page (5 rows) of raw data for the server side paged data table.
+    Only the rows of the requested page are sliced and serialized.
     Args:
         (pd.DataFrame) df - dataframe used for the computations
+        (int) page - index of the page of raw data to display
     Returns:
         (list) output_list - output list containing return values for
                             application layout components
     """
-    num_rows_to_show = ROW_ADVANCE
+    num_rows = len(df)
+    if num_rows == 0:
+        return [NO_TRIPS_TEXT, [], [], 0, 1, ""]
     output_list = []
-    output_list.append("Displaying rows {} through {} from data table".format(1, ROW_COUNTER))
+    page_count = max(1, -(-num_rows // ROW_ADVANCE))
+    page = min(max(page, 0), page_count - 1)
+    first_row = page * ROW_ADVANCE
+    last_row = min(first_row + ROW_ADVANCE, num_rows)
+    output_list.append("Displaying rows {} through {} from data table".format(first_row + 1, last_row))
 
     # Deselecting the last three columns as they're not part of the original data
-    raw_df = DF.iloc[: ROW_COUNTER, :-3]
-    last_page = ROW_COUNTER//ROW_ADVANCE - 1
-    raw_table = dash_table.DataTable(
-        id='table',
-        columns=[{"name": i, "id": i} for i in raw_df.columns],
-        data=raw_df.to_dict('records'),
-        page_size=num_rows_to_show,
-        page_current=last_page,
-        style_table={
-            'overflowY': 'scroll',
-        },
-        style_cell={'color': 'black'}
-    )
-    output_list.append(raw_table)
+    raw_df = df.iloc[first_row: last_row, :-3]
+    metrics.count_rows('display_raw_data', len(raw_df))
+    if 'End Time' in raw_df.columns:
+        # Only the rows of the page are converted
+        raw_df = raw_df.assign(**{'End Time': end_times(raw_df)})
+    output_list.append([{"name": i, "id": i} for i in raw_df.columns])
+    output_list.append(raw_df.to_dict('records'))
+    output_list.append(page)
+    output_list.append(page_count)
 
     # Print message if there are no more data to display
-    if ROW_COUNTER == len(DF):
+    if last_row == num_rows:
         warn_text = "There are no more data rows to show!!"
     else:
         warn_text = ""
     output_list.append(warn_text)
     return output_list
 # #############################################################################
+
+
+# STATS PIPELINE
+PIPELINE_POOL = ThreadPoolExecutor(max_workers=PIPELINE_THREADS, thread_name_prefix='stats')
+
+# Runs the background prefetches, apart from PIPELINE_POOL since a prefetch
+# waits for the stages it submits there
+PREFETCH_POOL = ThreadPoolExecutor(max_workers=PREFETCH_THREADS, thread_name_prefix='prefetch')
+
+# Running prefetches: {JSON of the selection_key(): future}
+PREFETCHES = {}
+PREFETCHES_LOCK = threading.Lock()
+
+# Tabs computed by the stats pipeline
+PIPELINE_TABS = ['time', 'station', 'trip', 'user', 'riders', 'raw']
+
+# Tabs computed from the cube summary; the 'raw' tab needs the filtered frame
+SUMMARY_TABS = ['time', 'station', 'trip', 'user', 'riders']
+
+
+def timed_call(func, *args):
+    """ Calls a function and returns its result and how long it took in seconds """
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+def json_payload(value):
+    """
+    Converts output lists holding Dash components and figures to plain JSON
+    data, as sent to the browser, so they can be cached and served again
+    """
+    return json.loads(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def tab_stage(tab, city, summary, df):
+    """ Returns the function computing the outputs of a tab, followed by its arguments """
+    return {'time': (time_stats, summary),
+            'station': (station_stats, summary),
+            'trip': (trip_duration_stats, summary),
+            'user': (user_stats, summary, city),
+            'riders': (station_riders_stats, summary),
+            'raw': (display_raw_data, df, 0)}[tab]
+
+
+@metrics.timed('stats_pipeline', 'compute')
+def stats_pipeline(city, month, weekday, tabs=None, date_range=None, hours=None, progress=None):
+    """
+    Computes the contents of output tabs for a filter selection concurrently,
+    see compute_tabs(). If some of the tabs are being prefetched, the prefetch
+    is waited for rather than computing the same tabs twice. Prefetches are
+    marked in RESULT_CACHE, so this works in a background job process too,
+    which does not see the prefetches of the app process.
+    """
+    key = selection_key(city, month, weekday, date_range, hours)
+    tabs_needed = PIPELINE_TABS if tabs is None else tabs
+    if set(tabs_needed) & set(RESULT_CACHE.pending(key)):
+        if progress is not None:
+            progress(0, 1, "Waiting for the tabs being prefetched")
+        RESULT_CACHE.wait_pending(key, tabs_needed, PREFETCH_WAIT_SECONDS)
+    return compute_tabs(city, month, weekday, tabs, date_range, hours, progress)
+
+
+def selection_key(city, month, weekday, date_range=None, hours=None):
+    """ Returns the result cache key of a filter selection, including the version of the city data """
+    return [city, filter_values(month), filter_values(weekday),
+            None if date_range is None else list(date_range),
+            None if hours is None else list(hours),
+            data_fingerprint(city)]
+
+
+def compute_tabs(city, month, weekday, tabs=None, date_range=None, hours=None, progress=None):
+    """
+    Computes the contents of output tabs for a filter selection concurrently.
+    The stats tabs share one cube summary and the raw data tab the filtered frame,
+    and each is only loaded if a requested tab needs it. Tabs computed before are
+    answered from RESULT_CACHE without computing anything.
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or 'none' to apply no month filter
+        (str) weekday - name of the day of week to filter by, or 'none'to apply no day filter
+        (list) tabs - tabs to compute, from PIPELINE_TABS, or None for all of them
+        (tuple) date_range - first and last date ('YYYY-MM-DD', either can be None), or None
+        (tuple) hours - first and last hour of the day (0 to 23), or None
+        (function) progress - called as progress(steps done, total steps, stage description)
+                              before the load stage and as each tab is computed, or None
+    Returns:
+        (dict) results - output lists of the requested tabs (as JSON data)
+        (dict) timings - seconds taken by each stage ('cache', 'load', the tabs and 'total')
+    """
+    start_time = time.perf_counter()
+    timings = {}
+    tabs = PIPELINE_TABS if tabs is None else tabs
+
+    key = selection_key(city, month, weekday, date_range, hours)
+    pipeline_results = {}
+    for tab in tabs:
+        pipeline_results.update(RESULT_CACHE.get(key, [tab]) or {})
+    missing = [tab for tab in tabs if tab not in pipeline_results]
+    timings['cache'] = time.perf_counter() - start_time
+    if not missing:
+        timings['total'] = timings['cache']
+        return pipeline_results, timings
+
+    # One progress step for the load stage and one per computed tab
+    if progress is not None:
+        progress(0, len(missing) + 1, "Loading the data of {}".format(CITY_DATA[city]))
+
+    # Load stage: the summary and the filtered frame are independent
+    summary = df = None
+    summary_future = df_future = None
+    if any(tab in SUMMARY_TABS for tab in missing):
+        summary_future = PIPELINE_POOL.submit(timed_call, load_summary, city, month, weekday, date_range, hours)
+    if 'raw' in missing:
+        df_future = PIPELINE_POOL.submit(timed_call, load_data, city, month, weekday, date_range, hours)
+    load_times = []
+    if summary_future is not None:
+        summary, summary_time = summary_future.result()
+        load_times.append(summary_time)
+    if df_future is not None:
+        df, df_time = df_future.result()
+        load_times.append(df_time)
+    timings['load'] = max(load_times)
+
+    # Compute stage
+    futures = {tab: PIPELINE_POOL.submit(timed_call, *tab_stage(tab, city, summary, df)) for tab in missing}
+    for step, (tab, future) in enumerate(futures.items(), start=1):
+        if progress is not None:
+            progress(step, len(missing) + 1, "Computing the {} stats".format(tab))
+        outputs, timings[tab] = future.result()
+        pipeline_results[tab] = json_payload(outputs)
+
+    # Cache the stats values along with the rendered outputs
+    new_results = dict(pipeline_results)
+    if summary is not None:
+        new_results['stats'] = all_stats_data(summary)
+    RESULT_CACHE.put(key, new_results)
+    timings['total'] = time.perf_counter() - start_time
+    return pipeline_results, timings
+
+
+@metrics.timed('prefetch_city_tabs', 'compute')
+def prefetch_city_tabs(city, month, weekday, tabs, date_range=None, hours=None):
+    """ Loads a city into the caches of this process, see warm_city(), and computes tabs of a selection """
+    warm_city(city)
+    return compute_tabs(city, month, weekday, tabs, date_range, hours)
+
+
+def prefetch_tabs(city, month, weekday, tabs, date_range=None, hours=None):
+    """
+    Starts computing tabs of a filter selection in the background, into the
+    result cache, unless they are being computed already. The city is loaded
+    into this process first; with PREFETCH_TABS off, that is all it does.
+    """
+    if not PREFETCH_TABS:
+        tabs = []
+    cache_key = selection_key(city, month, weekday, date_range, hours)
+    key = json.dumps(cache_key)
+    with PREFETCHES_LOCK:
+        if key in PREFETCHES:
+            return
+        RESULT_CACHE.mark_pending(cache_key, tabs)
+        future = PREFETCH_POOL.submit(prefetch_city_tabs, city, month, weekday, tabs, date_range, hours)
+        PREFETCHES[key] = future
+
+    def done(future):
+        with PREFETCHES_LOCK:
+            PREFETCHES.pop(key, None)
+        RESULT_CACHE.clear_pending(cache_key)
+        if future.exception() is not None:
+            print("Some error occurred in prefetch_tabs(): {}".format(future.exception()))
+    future.add_done_callback(done)
+
+
+def reset_after_fork():
+    """
+    Runs in the child process of a fork, e.g. a Dash background callback job.
+    The threads of the pools are not copied to the child, so the pools (which
+    would wait for them forever) and the running prefetches are started anew,
+    and so are the locks that one of those threads may have held.
+    """
+    global PIPELINE_POOL, PREFETCH_POOL, PREFETCHES, PREFETCHES_LOCK, LOAD_LOCKS, SHARD_POOL, SHARD_POOL_LOCK
+    PIPELINE_POOL = ThreadPoolExecutor(max_workers=PIPELINE_THREADS, thread_name_prefix='stats')
+    PREFETCH_POOL = ThreadPoolExecutor(max_workers=PREFETCH_THREADS, thread_name_prefix='prefetch')
+    PREFETCHES = {}
+    PREFETCHES_LOCK = threading.Lock()
+    LOAD_LOCKS = {key: threading.Lock() for key in LOAD_LOCKS}
+    SHARD_POOL = None
+    SHARD_POOL_LOCK = threading.Lock()
+    FRAME_CACHE.after_fork()
+    CUBE_CACHE.after_fork()
+    STREAM_CACHE.after_fork()
+    RESULT_CACHE.after_fork()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+# #############################################################################
@@ -0,0 +1,267 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_metrics.py' records timings of the hot paths and serves
+#         them in the Prometheus text format on the '/metrics' route
+# #############################################################################
+
+import os
+import json
+import time
+import cProfile
+import functools
+import threading
+from flask import Response, request
+
+
+# Global variables and data structures
+# Upper bounds (in seconds) of the buckets of the timing histograms
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# Upper bounds of the buckets of the row and byte count histograms
+SIZE_BUCKETS = [10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8]
+
+# Callbacks slower than this many seconds dump a cProfile file to PROFILE_DIR
+# (inside bikeshare_helper.CACHE_DIR). Profiling is off unless the
+# BIKESHARE_PROFILE_SLOW environment variable is set
+PROFILE_SLOW_SECONDS = float(os.environ['BIKESHARE_PROFILE_SLOW']) if os.environ.get('BIKESHARE_PROFILE_SLOW') else None
+PROFILE_DIR = os.path.join('cache', 'profiles')
+
+# Background callback jobs run in forked processes, whose metrics would be lost
+# when they exit: they write them to this folder instead (see spooled()), and
+# the process serving '/metrics' adds them to its own when it is scraped
+SPOOL_DIR = os.path.join('cache', 'metrics')
+
+# Whether this process is a fork of the app process, see after_fork()
+FORKED = False
+
+
+# #############################################################################
+# Class and function definitions
+class Histogram:
+    """
+    Prometheus style histogram: cumulative bucket counts, sum and count per label set
+    """
+
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """ Records one value for the given label values """
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def take(self):
+        """ Returns the recorded series as JSON data and starts the histogram over """
+        with self._lock:
+            series, self._series = self._series, {}
+        return [[list(label_values), values] for label_values, values in series.items()]
+
+    def merge(self, series):
+        """ Adds series returned by take(), e.g. in another process, to the histogram """
+        with self._lock:
+            for label_values, values in series:
+                label_values = tuple(label_values)
+                own = self._series.get(label_values)
+                if own is None:
+                    own = self._series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                own['buckets'] = [a + b for a, b in zip(own['buckets'], values['buckets'])]
+                own['sum'] += values['sum']
+                own['count'] += values['count']
+
+    def after_fork(self):
+        """ Starts the histogram over in a forked child, which only reports its own observations """
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def render(self):
+        """ Returns the histogram in the Prometheus text format """
+        lines = ["# HELP {} {}".format(self.name, self.description),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = ",".join('{}="{}"'.format(k, v) for k, v in zip(self.label_names, label_values))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, labels, bound, count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, labels, series['count']))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, labels, series['sum']))
+                lines.append('{}_count{{{}}} {}'.format(self.name, labels, series['count']))
+        return "\n".join(lines)
+
+
+STAGE_SECONDS = Histogram('bikeshare_stage_seconds',
+                          "Time spent in each instrumented function, by phase (load, compute, render, callback)",
+                          ['stage', 'phase'], SECONDS_BUCKETS)
+ROWS_SCANNED = Histogram('bikeshare_rows_scanned',
+                         "Number of data rows scanned by each instrumented function",
+                         ['stage'], SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram('bikeshare_response_bytes',
+                           "Size of the serialized callback responses, by first output",
+                           ['output'], SIZE_BUCKETS)
+HISTOGRAMS = [STAGE_SECONDS, ROWS_SCANNED, RESPONSE_BYTES]
+
+# Gauges computed when the metrics are scraped: {name: (description, function returning {label: value})}
+GAUGES = {}
+
+
+def timed(stage, phase, profile=False):
+    """
+    Decorator recording the duration of every call of a function in STAGE_SECONDS.
+
+    Args:
+        (str) stage - name of the stage, usually the function name
+        (str) phase - 'load', 'compute', 'render' or 'callback'
+        (bool) profile - whether slow calls dump a cProfile file (see PROFILE_SLOW_SECONDS)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = None
+            if profile and PROFILE_SLOW_SECONDS is not None:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start_time
+                STAGE_SECONDS.observe(seconds, stage, phase)
+                if profiler is not None:
+                    profiler.disable()
+                    if seconds > PROFILE_SLOW_SECONDS:
+                        dump_profile(profiler, stage)
+        return wrapper
+    return decorator
+
+
+def spooled(func):
+    """
+    Decorator for the functions run as background jobs: in a forked process the
+    metrics recorded by the call (including those of the decorators below this
+    one) are written to SPOOL_DIR when it returns
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if FORKED:
+                spool()
+    return wrapper
+
+
+def spool():
+    """ Moves the metrics recorded by this process to a file of SPOOL_DIR """
+    try:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        path = os.path.join(SPOOL_DIR, "{}-{}.json".format(os.getpid(), int(time.time() * 1000)))
+        with open(path + '.tmp', 'w') as f:
+            json.dump({histogram.name: histogram.take() for histogram in HISTOGRAMS}, f)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        print("Some error occurred in spool(): {}".format(e))
+
+
+def collect_spool():
+    """ Adds the metrics written to SPOOL_DIR by other processes to the metrics of this one """
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except OSError:
+        return
+    histograms = {histogram.name: histogram for histogram in HISTOGRAMS}
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            # Rename first, so each file is collected by one process only
+            claimed = "{}.{}.claimed".format(path, os.getpid())
+            os.rename(path, claimed)
+            with open(claimed) as f:
+                spooled_metrics = json.load(f)
+            os.remove(claimed)
+        except (OSError, ValueError):
+            continue
+        for histogram_name, series in spooled_metrics.items():
+            if histogram_name in histograms:
+                histograms[histogram_name].merge(series)
+
+
+def after_fork():
+    """ Runs in a forked child process: its metrics start from zero and are spooled """
+    global FORKED
+    FORKED = True
+    for histogram in HISTOGRAMS:
+        histogram.after_fork()
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+def dump_profile(profiler, stage):
+    """ Writes the stats of a profiler to PROFILE_DIR, for 'python -m pstats' or snakeviz """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, "{}-{}-{}.prof".format(stage, int(time.time() * 1000), threading.get_ident()))
+        profiler.dump_stats(path)
+    except Exception as e:
+        print("Some error occurred in dump_profile(): {}".format(e))
+
+
+def count_rows(stage, rows):
+    """ Records the number of data rows scanned by a stage """
+    ROWS_SCANNED.observe(rows, stage)
+
+
+def register_gauge(name, description, func):
+    """
+    Registers a gauge whose values are read when the metrics are scraped.
+    func returns a {label value: number} dict, exported with a 'name' label.
+    """
+    GAUGES[name] = (description, func)
+
+
+def render_metrics():
+    """ Returns all the metrics in the Prometheus text format """
+    collect_spool()
+    parts = [histogram.render() for histogram in HISTOGRAMS]
+    for name, (description, func) in GAUGES.items():
+        lines = ["# HELP {} {}".format(name, description), "# TYPE {} gauge".format(name)]
+        for label, value in func().items():
+            lines.append('{}{{name="{}"}} {}'.format(name, label, value))
+        parts.append("\n".join(lines))
+    return "\n".join(parts) + "\n"
+
+
+def record_response_size(response):
+    """ Flask after_request hook recording the size of the Dash callback responses """
+    if request.path.endswith('/_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        # Label with the first output id only, to keep the number of series small
+        output = str(body.get('output', '')).strip('.').split('.')[0]
+        RESPONSE_BYTES.observe(response.calculate_content_length() or 0, output)
+    return response
+
+
+def register_metrics_route(server):
+    """
+    Adds the '/metrics' route and the response size hook to the Flask server of the Dash app
+    """
+    server.after_request(record_response_size)
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+# #############################################################################
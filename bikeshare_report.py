@@ -0,0 +1,188 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_report.py' computes the statistics of every filter
+#         selection without the web application and writes them as reports
+#   Usage: python bikeshare_report.py
+#          python bikeshare_report.py --cities chicago nyc --format csv
+#          python bikeshare_report.py --csv data/extra_trips.csv --workers 2
+#          python bikeshare_report.py --cities nyc --approx-routes count-min
+# #############################################################################
+
+import os
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import bikeshare_helper as bk
+import bikeshare_cube as cube
+
+
+# Global variables and data structures
+# Reports are written to this folder, one file per city (or csv file) and format
+REPORT_DIR = 'reports'
+
+# Columns of the long format csv reports
+CSV_COLUMNS = ['city', 'month', 'weekday', 'table', 'row', 'column', 'value']
+
+
+# #############################################################################
+# Function definitions
+def filter_selections(city_cube):
+    """
+    Returns every (month, weekday) filter selection of a cube, 'none' included,
+    limited to the months and weekdays present in the data
+    """
+    index = city_cube['counts'].index
+    months = set(index.get_level_values('Month').dropna())
+    weekdays = set(index.get_level_values('Weekday').dropna())
+    month_filters = ['none'] + [m.lower() for m in bk.MONTH_NAMES if m in months]
+    weekday_filters = ['none'] + [d.lower() for d in bk.WEEKDAY_NAMES if d in weekdays]
+    return [(month, weekday) for month in month_filters for weekday in weekday_filters]
+
+
+def city_report(name, path=None, approx_routes=None):
+    """
+    Computes the statistics of every filter selection of one city or csv file.
+    Runs in a worker process, so it only takes and returns plain data.
+
+    Args:
+        (str) name - name of the city, or the report name of the csv file
+        (str) path - csv file in the layout of the city data files, or None for a city of CITY_DATA
+        (str) approx_routes - 'space-saving' or 'count-min' to also list the most popular
+                              trips of all the data from one bounded memory pass over
+                              the csv file(s), see bikeshare_helper.stream_top_routes(), or None
+    Returns:
+        (dict) report - {'name', 'source', 'seconds', 'selections': list of
+                        {'month', 'weekday', 'stats'}}, see bikeshare_helper.all_stats_data(),
+                        and the 'approx_routes' table (with its 'method') if requested
+    """
+    start_time = time.time()
+    if path is None:
+        city_cube = bk.load_city_cube(name)
+        source = bk.CITY_DATA[name]
+    else:
+        city_cube = cube.build_cube(bk.read_csv_files([path]))
+        source = path
+
+    selections = []
+    for month, weekday in filter_selections(city_cube):
+        summary = cube.query_cube(city_cube, month, weekday)
+        # Month and weekday pairs without trips have no stats
+        if summary['rows'] == 0:
+            continue
+        selections.append({'month': month,
+                           'weekday': weekday,
+                           'stats': bk.all_stats_data(summary)})
+    report = {'name': name,
+              'source': source,
+              'selections': selections}
+    if approx_routes is not None:
+        table = bk.stream_top_routes(name, 'none', 'none', method=approx_routes,
+                                     paths=None if path is None else [path])
+        report['approx_routes'] = dict(table, method=approx_routes)
+    report['seconds'] = round(time.time() - start_time, 4)
+    return report
+
+
+def report_rows(report):
+    """
+    Flattens a report into long format csv rows (see CSV_COLUMNS), one row per table cell
+    """
+    for selection in report['selections']:
+        prefix = [report['name'], selection['month'], selection['weekday']]
+        yield prefix + ['summary', 0, 'Trips', selection['stats']['rows']]
+        for table_name, table in selection['stats'].items():
+            if not isinstance(table, dict):
+                continue
+            for row_number, row in enumerate(table['rows']):
+                for column, value in zip(table['columns'], row):
+                    yield prefix + [table_name, row_number, column, value]
+    # The approximate trips are counted over all the data, the unfiltered selection
+    if 'approx_routes' in report:
+        table = report['approx_routes']
+        for row_number, row in enumerate(table['rows']):
+            for column, value in zip(table['columns'], row):
+                yield [report['name'], 'none', 'none', 'approx_routes', row_number, column, value]
+
+
+def write_report(report, out_dir, formats):
+    """
+    Writes a report as json and/or csv files named after the city or csv file.
+
+    Returns:
+        (list) paths - the files written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    if 'json' in formats:
+        path = os.path.join(out_dir, "{}.json".format(report['name']))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        paths.append(path)
+    if 'csv' in formats:
+        path = os.path.join(out_dir, "{}.csv".format(report['name']))
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            writer.writerows(report_rows(report))
+        paths.append(path)
+    return paths
+
+
+def run_reports(jobs, out_dir=REPORT_DIR, formats=('json', 'csv'), workers=None, approx_routes=None):
+    """
+    Computes and writes the reports of several cities / csv files in a process pool.
+
+    Args:
+        (list) jobs - (name, csv path or None) pairs, see city_report()
+        (str) out_dir - folder the reports are written to
+        (tuple) formats - 'json' and/or 'csv'
+        (int) workers - number of worker processes, defaults to the number of CPUs
+        (str) approx_routes - heavy hitters method of the approximate trips, see city_report(), or None
+    Returns:
+        (bool) ok - whether every report was written
+    """
+    ok = True
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(city_report, name, path, approx_routes): name for name, path in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                report = future.result()
+                paths = write_report(report, out_dir, formats)
+                print("{}: {} filter selections in {} seconds -> {}".format(
+                      name, len(report['selections']), report['seconds'], ", ".join(paths)))
+            except Exception as e:
+                print("Some error occurred in run_reports() for {}: {}".format(name, e))
+                ok = False
+    return ok
+
+
+# Main Function
+# #############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="US bikeshare statistics reports")
+    parser.add_argument('--cities', nargs='*', choices=list(bk.CITY_DATA),
+                        help="cities to report on (default: all, unless --csv is given)")
+    parser.add_argument('--csv', nargs='+', default=[],
+                        help="csv files in the layout of the city data files, reported under their file name")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--out-dir', default=REPORT_DIR)
+    parser.add_argument('--format', choices=['json', 'csv', 'both'], default='both')
+    parser.add_argument('--approx-routes', choices=['space-saving', 'count-min'], default=None,
+                        help="also list the most popular trips from one bounded memory pass over the csv files")
+    args = parser.parse_args()
+
+    cities = args.cities if args.cities is not None else ([] if args.csv else list(bk.CITY_DATA))
+    jobs = [(city, None) for city in cities]
+    jobs += [(os.path.splitext(os.path.basename(path))[0], path) for path in args.csv]
+    if not jobs:
+        parser.error("nothing to report on")
+
+    formats = ('json', 'csv') if args.format == 'both' else (args.format,)
+    if not run_reports(jobs, args.out_dir, formats, args.workers, args.approx_routes):
+        raise SystemExit(1)
@@ -0,0 +1,188 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_results.py' caches the computed results of each filter
+#         selection in memory and on disk, shared by all the worker processes
+# #############################################################################
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# #############################################################################
+# Class definitions
+class ResultCache:
+    """
+    LRU cache of computed results with a time to live, kept in memory and in a
+    directory shared by every worker process on the host.
+
+    A key is a list of JSON values, e.g. [city, month, weekday, data fingerprint];
+    its entry is a dict of named results (e.g. one per output tab) that can be
+    filled in over several requests. Results must be JSON serializable.
+    """
+
+    def __init__(self, directory, ttl, max_entries):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.directory, "{}.json".format(digest))
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _usable(self, entry, names):
+        return (entry is not None and entry['created'] >= time.time() - self.ttl
+                and all(name in entry['values'] for name in names))
+
+    def get(self, key, names):
+        """
+        Returns the named results stored for a key, or None unless all of them are
+        there and fresh. Hits mark the entry as recently used, in memory and on disk.
+        """
+        path = self._path(key)
+        with self._lock:
+            entry = self._entries.get(path)
+        if not self._usable(entry, names):
+            # Another worker may have stored the missing results
+            entry = self._read(path)
+        if not self._usable(entry, names):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            self.hits += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return {name: entry['values'][name] for name in names}
+
+    def put(self, key, values):
+        """
+        Adds named results to the entry of a key (a new entry is started if the
+        stored one expired) and evicts the least recently used entries over the cap
+        """
+        path = self._path(key)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            entry = self._read(path)
+        if entry is None or entry['created'] < time.time() - self.ttl:
+            entry = {'key': key, 'created': time.time(), 'values': {}}
+        entry = dict(entry, values=dict(entry['values'], **values))
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self.prune()
+        except Exception as e:
+            print("Some error occurred in ResultCache.put(): {}".format(e))
+
+    def prune(self):
+        """ Deletes the expired entry files, and the least recently used ones over the cap """
+        cutoff = time.time() - self.ttl
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.json'):
+                    mtime = os.path.getmtime(path)
+                    if mtime < cutoff:
+                        os.remove(path)
+                    else:
+                        files.append((mtime, path))
+            except OSError:
+                pass
+        for _, path in sorted(files)[:max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def mark_pending(self, key, names):
+        """
+        Marks named results of a key as being computed by this process (e.g. a
+        prefetch), so other processes can wait for them, see wait_pending()
+        """
+        path = self._path(key)[:-len('.json')] + '.pending'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump({'pid': os.getpid(), 'names': list(names)}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print("Some error occurred in ResultCache.mark_pending(): {}".format(e))
+
+    def clear_pending(self, key):
+        """ Removes the mark of mark_pending() once the results are stored (or failed) """
+        try:
+            os.remove(self._path(key)[:-len('.json')] + '.pending')
+        except OSError:
+            pass
+
+    def pending(self, key):
+        """ Returns the names of the results of a key being computed by a live process, see mark_pending() """
+        pending = self._read(self._path(key)[:-len('.json')] + '.pending')
+        if pending is None:
+            return []
+        try:
+            # Signal 0 only checks that the computing process is alive
+            os.kill(pending['pid'], 0)
+        except ProcessLookupError:
+            return []
+        except OSError:
+            pass
+        return pending['names']
+
+    def wait_pending(self, key, names, timeout):
+        """
+        Waits until none of the named results of a key is being computed, or for
+        at most `timeout` seconds, see pending()
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline and set(names) & set(self.pending(key)):
+            time.sleep(0.05)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def after_fork(self):
+        """ Replaces the lock in a forked child process, where a thread that was not copied may hold it """
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """ Returns the cache counters of this process """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries)}
+# #############################################################################
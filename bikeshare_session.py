@@ -0,0 +1,131 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_session.py' keeps the per-user (session) state on the server
+# #############################################################################
+
+import os
+import json
+import time
+import uuid
+import threading
+import bikeshare_helper as bk
+
+
+# Global variables and data structures
+# Session files are shared by every worker process on the host, so a request
+# can be served by any worker regardless of which one created the session
+SESSION_DIR = os.path.join(bk.CACHE_DIR, 'sessions')
+
+# Sessions not updated for this many seconds are deleted
+SESSION_TTL = 24 * 60 * 60
+
+# State of a freshly created session
+DEFAULT_STATE = {'city': None,
+                 'month': 'none',
+                 'weekday': 'none',
+                 'date_range': None,
+                 'hours': None,
+                 'page': 0}
+
+
+# #############################################################################
+# Function definitions
+def new_session_id():
+    """ Returns a new random session id, stored in the browser by the app layout """
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """
+    Session keyed store of each user's filter selection and raw data page.
+    Only the selection is kept per session; the data itself is always taken
+    from the shared city frame cache in bikeshare_helper.
+    """
+
+    def __init__(self, directory=SESSION_DIR, ttl=SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _path(self, session_id):
+        # Session ids are uuid hex strings; anything else is rejected so the
+        # id can never point outside the session directory
+        return os.path.join(self.directory, "{}.json".format(uuid.UUID(hex=session_id).hex))
+
+    def get(self, session_id):
+        """
+        Returns a copy of the state of a session, or the default state for an unknown session.
+        The state kept in memory is only used while its file is unchanged, since
+        other processes (workers and background callback jobs) update the file.
+        """
+        path = self._path(session_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            state, saved_mtime = self._sessions.get(session_id, (None, None))
+        if state is None or saved_mtime != mtime:
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                with self._lock:
+                    self._sessions[session_id] = (state, mtime)
+            except (OSError, ValueError):
+                state = DEFAULT_STATE
+        # Fields added since the session was saved get their default value
+        return dict(DEFAULT_STATE, **state)
+
+    def save(self, session_id, state):
+        """ Stores the state of a session in memory and in the session directory """
+        state = dict(state, updated=time.time())
+        path = self._path(session_id)
+        with self._lock:
+            is_new = session_id not in self._sessions
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+            mtime = os.path.getmtime(path)
+        except Exception as e:
+            print("Some error occurred in SessionStore.save(): {}".format(e))
+            mtime = None
+        with self._lock:
+            self._sessions[session_id] = (state, mtime)
+        if is_new:
+            self.prune()
+
+    def update(self, session_id, **changes):
+        """ Updates some fields of a session and returns its new state """
+        state = self.get(session_id)
+        state.update(changes)
+        self.save(session_id, state)
+        return state
+
+    def prune(self):
+        """ Deletes sessions that have not been updated within the ttl """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for session_id in [k for k, v in self._sessions.items() if v[0]['updated'] < cutoff]:
+                del self._sessions[session_id]
+        try:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def after_fork(self):
+        """ Replaces the lock in a forked child process, where a thread that was not copied may hold it """
+        self._lock = threading.Lock()
+
+
+# Shared by every request served by this process
+SESSIONS = SessionStore()
+os.register_at_fork(after_in_child=SESSIONS.after_fork)
+# #############################################################################
@@ -0,0 +1,90 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_shards.py' splits the city data into shards (row ranges)
+#         and computes a function of each shard in a pool of worker processes,
+#         which read the data from the memory-mapped column store file
+# #############################################################################
+
+import os
+import numpy as np
+import bikeshare_columns as column_store
+
+
+# Global variables and data structures
+# Column store files mapped by this (worker) process: {path: (stamp, df)}
+MAPPED_FRAMES = {}
+
+
+# #############################################################################
+# Function definitions
+def file_stamp(path):
+    """ Returns the (mtime, size) of a file, identifying the version the workers must read """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def mapped_frame(path, stamp):
+    """
+    Returns the DataFrame of a column store file, mapped once per process and
+    version of the file. A file replaced since the shards were planned raises
+    ValueError, since its row ranges may no longer match.
+    """
+    entry = MAPPED_FRAMES.get(path)
+    if entry is None or entry[0] != stamp:
+        if file_stamp(path) != tuple(stamp):
+            raise ValueError("{} changed while its shards were computed".format(path))
+        entry = (stamp, column_store.read_column_store(path))
+        MAPPED_FRAMES[path] = entry
+    return entry[1]
+
+
+def row_shards(first_row, last_row, num_shards):
+    """ Splits the rows [first_row, last_row) into at most num_shards (start, stop) ranges of equal size """
+    bounds = np.linspace(first_row, last_row, max(1, num_shards) + 1).round().astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def month_shards(month_codes, first_row=0):
+    """
+    Splits rows sorted by time into one (start, stop) range per month, from the
+    codes of their 'Month' column (the months of sorted rows are contiguous)
+
+    Args:
+        (np.array) month_codes - category codes of the 'Month' column of the rows
+        (int) first_row - row number of the first code
+    Returns:
+        (list) shards - (start, stop, month code) of each month present
+    """
+    if len(month_codes) == 0:
+        return []
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(month_codes)) + 1, [len(month_codes)]])
+    return [(first_row + int(start), first_row + int(stop), int(month_codes[start]))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def map_shard(path, stamp, start, stop, func, args):
+    """
+    Runs in a worker process: applies a function to the rows [start, stop) of a
+    column store file. The function and its arguments are sent by reference
+    (pickled), so it must be defined at the top level of a module.
+    """
+    return func(mapped_frame(path, stamp).iloc[start:stop], *args)
+
+
+def map_shards(pool, path, shards, func, *args):
+    """
+    Computes a function of each shard of a column store file in a process pool.
+
+    Args:
+        (ProcessPoolExecutor) pool - worker processes
+        (str) path - column store file, see bikeshare_columns.py
+        (list) shards - (start, stop) row ranges
+        (function) func - called as func(rows of the shard, *args), returning partial aggregates
+    Returns:
+        (list) partials - the result of each shard, in shard order
+    """
+    stamp = file_stamp(path)
+    futures = [pool.submit(map_shard, path, stamp, start, stop, func, args) for start, stop in shards]
+    return [future.result() for future in futures]
+# #############################################################################
@@ -0,0 +1,205 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_sketch.py' contains bounded memory summaries of data
+#         streams, used when the data is too large to be counted exactly
+# #############################################################################
+
+import math
+import numpy as np
+import pandas as pd
+
+
+# Global variables and data structures
+# Station codes are combined into one integer per station pair as
+# start code * MAX_CODES + end code
+MAX_CODES = 2 ** 31
+
+
+# #############################################################################
+# Class and function definitions
+class Vocabulary:
+    """
+    Dictionary of the values seen in a stream, giving every value a stable
+    integer code across chunks (pd.factorize codes are only valid per chunk)
+    """
+
+    def __init__(self):
+        self.values = pd.Index([])
+
+    def encode(self, values):
+        """ Returns the codes of the values (-1 for missing values), adding unseen ones """
+        codes = self.values.get_indexer(values)
+        unseen = (codes == -1) & pd.notna(values)
+        if unseen.any():
+            self.values = self.values.append(pd.Index(pd.unique(values[unseen])))
+            codes = self.values.get_indexer(values)
+        return codes
+
+
+def pair_keys(start_codes, end_codes):
+    """ Combines two arrays of codes into one int64 key per row, dropping pairs with a missing value """
+    keep = (start_codes >= 0) & (end_codes >= 0)
+    return start_codes[keep].astype(np.int64) * MAX_CODES + end_codes[keep]
+
+
+def split_pair_keys(keys):
+    """ Returns the (start codes, end codes) of keys made by pair_keys() """
+    return np.divmod(np.asarray(keys, dtype=np.int64), MAX_CODES)
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the most frequent keys of a stream, keeping at most
+    `capacity` counters. The counters are kept in the mergeable (Misra-Gries)
+    form, which lets a whole chunk be added with vectorized NumPy operations:
+    the chunk is counted exactly, added to the counters, and the counters are
+    reduced back to `capacity` by subtracting the (capacity + 1)-th largest count.
+
+    Error bound: for every key, count <= true frequency <= count + error(),
+    where error() <= N / (capacity + 1) for a stream of N items. Every key
+    occurring more than N / (capacity + 1) times is guaranteed to be kept.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.total = 0
+
+    def update(self, keys):
+        """ Adds a chunk of int64 keys to the summary """
+        chunk_keys, chunk_counts = np.unique(keys, return_counts=True)
+        self.merge(chunk_keys, chunk_counts)
+
+    def merge(self, keys, counts):
+        """ Adds (key, count) pairs, e.g. the counters of another summary, to the summary """
+        self.total += int(np.sum(counts))
+        all_keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        all_counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+        if len(all_keys) > self.capacity:
+            cut = np.partition(all_counts, len(all_counts) - self.capacity - 1)[len(all_counts) - self.capacity - 1]
+            all_counts = all_counts - cut
+            keep = all_counts > 0
+            all_keys, all_counts = all_keys[keep], all_counts[keep]
+        self.keys, self.counts = all_keys, all_counts
+
+    def error(self):
+        """ Returns the largest possible undercount of any key """
+        return (self.total - int(self.counts.sum())) // (self.capacity + 1)
+
+    def top(self, k):
+        """
+        Returns the k keys with the largest counts (ties go to the smallest key)
+        as (keys, lower bounds, upper bounds) arrays
+        """
+        order = np.lexsort((self.keys, -self.counts))[:k]
+        return self.keys[order], self.counts[order], self.counts[order] + self.error()
+
+
+def log_bucket_codes(values, accuracy):
+    """
+    Returns the logarithmic bucket (DDSketch style) of each value: bucket i
+    holds the values in (gamma ** (i - 1), gamma ** i], with
+    gamma = (1 + accuracy) / (1 - accuracy). Values below 1 are counted in
+    the bucket of 1, and missing values get bucket -1.
+
+    The bucket counts of two sets of values add up to the bucket counts of
+    their union, so the sketches of any partitions of the data can be merged.
+    """
+    gamma = (1 + accuracy) / (1 - accuracy)
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    buckets = np.ceil(np.log(np.maximum(np.where(missing, 1, values), 1)) / np.log(gamma)).astype(np.int64)
+    buckets[missing] = -1
+    return buckets
+
+
+def log_bucket_quantiles(counts, quantiles, accuracy):
+    """
+    Estimates quantiles from the counts of log buckets (see log_bucket_codes()).
+
+    Accuracy: for values of at least 1, each estimate is within `accuracy`
+    (relative error) of the exact lower quantile, the value of rank
+    floor(q * (n - 1)) of the n sorted values, whatever the data. The count
+    tables only grow with the log of the range of the values.
+
+    Args:
+        (pd.Series) counts - trip counts indexed by bucket
+        (list) quantiles - quantiles to estimate, between 0 and 1
+        (float) accuracy - relative accuracy the buckets were built with
+    Returns:
+        (np.array) estimates - the estimated value of each quantile
+    """
+    gamma = (1 + accuracy) / (1 - accuracy)
+    counts = counts[counts.index >= 0].sort_index()
+    cumulative = np.cumsum(counts.values)
+    ranks = np.floor(np.asarray(quantiles, dtype=np.float64) * (cumulative[-1] - 1))
+    buckets = counts.index.values[np.searchsorted(cumulative, ranks, side='right')]
+    # The value within a bucket with the smallest relative error to either end
+    return 2 * gamma ** buckets.astype(np.float64) / (gamma + 1)
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch of the frequencies of a stream of int64 keys, with a
+    candidate set of the `capacity` keys with the largest estimates.
+
+    With width = ceil(e / epsilon) and depth = ceil(ln(1 / delta)), every
+    estimate satisfies true frequency <= estimate <= true frequency + epsilon * N
+    with probability at least 1 - delta, for a stream of N items.
+    A key can only be missing from the candidates if its estimate was too small
+    when it last occurred, the usual limitation of the Count-Min + heap method.
+    """
+
+    def __init__(self, epsilon, delta, capacity, seed=0):
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.capacity = capacity
+        self.epsilon = epsilon
+        self.delta = delta
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        # Multiply-shift hashing: one random odd 64 bit multiplier per row
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 2 ** 63, size=self.depth, dtype=np.uint64) | np.uint64(1)
+        self.candidates = np.empty(0, dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, row, keys):
+        hashed = keys.astype(np.uint64) * self.multipliers[row]
+        return (hashed >> np.uint64(32)) % np.uint64(self.width)
+
+    def update(self, keys):
+        """ Adds a chunk of int64 keys to the sketch and refreshes the candidates """
+        keys = np.asarray(keys, dtype=np.int64)
+        self.total += len(keys)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(self._columns(row, keys).astype(np.int64), minlength=self.width)
+
+        candidates = np.unique(np.concatenate([self.candidates, keys]))
+        if len(candidates) > self.capacity:
+            estimates = self.estimate(candidates)
+            order = np.lexsort((candidates, -estimates))[:self.capacity]
+            candidates = candidates[order]
+        self.candidates = candidates
+
+    def estimate(self, keys):
+        """ Returns the estimated frequencies (upper bounds) of int64 keys """
+        keys = np.asarray(keys, dtype=np.int64)
+        return np.min([self.table[row][self._columns(row, keys).astype(np.int64)]
+                       for row in range(self.depth)], axis=0)
+
+    def error(self):
+        """ Returns the largest overcount of any estimate (with probability 1 - delta) """
+        return int(math.ceil(self.epsilon * self.total))
+
+    def top(self, k):
+        """
+        Returns the k candidates with the largest estimates (ties go to the smallest key)
+        as (keys, lower bounds, upper bounds) arrays
+        """
+        estimates = self.estimate(self.candidates)
+        order = np.lexsort((self.candidates, -estimates))[:k]
+        upper = estimates[order]
+        return self.candidates[order], np.maximum(upper - self.error(), 0), upper
+# #############################################################################
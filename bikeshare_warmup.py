@@ -0,0 +1,104 @@
+#   Udacity Programming for Datascience with Python Nanodegree
+#   Project: US bikeshare
+#   By: Anuradha Pani
+#   File: 'bikeshare_warmup.py' preloads the city data when the app starts
+#         and serves the readiness of the app on the '/ready' route
+# #############################################################################
+
+import os
+import json
+import time
+import threading
+from flask import Response
+import bikeshare_helper as bk
+
+
+# Global variables and data structures
+# Cities loaded when the app starts, from the BIKESHARE_PRELOAD_CITIES
+# environment variable (comma separated city names, or 'none'), all cities by default
+if os.environ.get('BIKESHARE_PRELOAD_CITIES'):
+    PRELOAD_CITIES = [city.strip() for city in os.environ['BIKESHARE_PRELOAD_CITIES'].split(',')
+                      if city.strip() in bk.CITY_DATA]
+else:
+    PRELOAD_CITIES = list(bk.CITY_DATA)
+
+
+# #############################################################################
+# Class and function definitions
+class WarmUp:
+    """
+    Preloads cities in background threads, one per city: the city data and cube
+    are loaded (parsing the csv files if the cache is cold) and the unfiltered
+    selection is computed, which also warms up the render path and the result cache.
+    """
+
+    def __init__(self, cities):
+        self.cities = list(cities)
+        self.status = {city: 'pending' for city in self.cities}
+        self.seconds = {}
+        self.started = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts the warm-up threads, unless they were started already, and returns at once """
+        with self._lock:
+            if self.started is not None:
+                return
+            self.started = time.time()
+        if self.cities:
+            print("Warm-up: preloading {}".format(", ".join(self.cities)), flush=True)
+        for city in self.cities:
+            threading.Thread(target=self.preload, args=(city,), name='warmup-{}'.format(city), daemon=True).start()
+
+    def preload(self, city):
+        """ Loads and prepares one city, recording its status """
+        with self._lock:
+            self.status[city] = 'loading'
+        start_time = time.time()
+        try:
+            bk.stats_pipeline(city, 'none', 'none')
+            status = 'ready'
+        except RuntimeError as e:
+            # The interpreter exits while the city loads: the thread pools refuse
+            # new work ("cannot schedule new futures after shutdown"), which is
+            # not a failure of the city
+            if 'shutdown' not in str(e):
+                raise
+            with self._lock:
+                self.status[city] = 'cancelled'
+            return
+        except Exception as e:
+            print("Some error occurred in WarmUp.preload() for {}: {}".format(city, e), flush=True)
+            status = 'failed'
+        with self._lock:
+            self.status[city] = status
+            self.seconds[city] = round(time.time() - start_time, 4)
+            done = sum(s in ('ready', 'failed') for s in self.status.values())
+            print("Warm-up: {} {} in {} seconds ({}/{} cities done)".format(
+                  city, status, self.seconds[city], done, len(self.cities)), flush=True)
+
+    def report(self):
+        """
+        Returns the warm-up status of every city; the app is ready once every
+        city is preloaded (a failed city does not block readiness)
+        """
+        with self._lock:
+            return {'ready': all(status in ('ready', 'failed', 'cancelled') for status in self.status.values()),
+                    'cities': dict(self.status),
+                    'seconds': dict(self.seconds)}
+
+
+def register_readiness_route(server, warmup):
+    """
+    Adds the '/ready' route to the Flask server of the Dash app: 200 once the
+    warm-up is done, 503 before, with the status of each city as JSON.
+    The warm-up is started by the first request (e.g. the first '/ready' probe)
+    if the server entry point did not start it, so importing the app loads nothing.
+    """
+    server.before_request(warmup.start)
+
+    @server.route('/ready')
+    def ready():
+        report = warmup.report()
+        return Response(json.dumps(report), status=200 if report['ready'] else 503, mimetype='application/json')
+# #############################################################################